@@ -2,6 +2,8 @@ import sys
 import socket
 import struct
 from helpers import *
+from encoder import createQuery as encodeQuery, EDNS_PAYLOAD, MAX_MESSAGE, TC
+from batchClient import batchMain
 import pprint
 import time
 
@@ -53,105 +55,22 @@ invertedClasses = {v: k for k, v in qclass.items()}
 
 def createQuery(queryType):
 
-    # The header contains the following fields:
-
-    #                                 1  1  1  1  1  1
-    #   0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                      ID                       |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |QR|   Opcode  |AA|TC|RD|RA|   Z    |   RCODE   |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                    QDCOUNT                    |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                    ANCOUNT                    |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                    NSCOUNT                    |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                    ARCOUNT                    |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-
-    header_id = 0xABCE # Make this random
-
-    qr = 0
-    opcode = 0
-    aa = 0
-    tc = 0
-    rd = 0
-    ra = 0
-    z = 0
-    rcode = 0
-
-    header_flags = (qr << 15) | (opcode << 11) | (aa << 10) | (tc << 9) | (rd << 8) | (ra << 7) | (z << 4) | rcode
-
-    qdCount = 1
-    anCount = 0
-    nsCount = 0
-    arCount = 0
-
-    # Pack data into bytes, !HHHHHH, as we have 2 bytes for each part of the header, and 6
-    # parts of the header.
-    headerData = struct.pack('!HHHHHH',header_id, header_flags, qdCount, anCount, nsCount, arCount)
-
-    # Question section of query.
-    #                                 1  1  1  1  1  1
-    #   0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                                               |
-    # /                     QNAME                     /
-    # /                                               /
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                     QTYPE                     |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-    # |                     QCLASS                    |
-    # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
-
-    labels = name.split('.')
-
-    qname = b'' # Required to be byte literal like data from struct.pack
-
-    for label in labels:
-        length = len(label)
-
-        qname += struct.pack('!B', length) + label.encode()
-
-    qname += b'\x00'
-
+    # Header and question are written by the shared encoder, see encoder.py for the layout.
+    # The header ID is random.
     qtype = types[queryType]
 
+    queryName = name
     if invertedTypes[qtype] == 'PTR':
-        qname = encodePTRName(name)
-
-    qclassInfo = qclass['IN']
+        queryName = ptrName(name)
 
-    question = qname + struct.pack("!HH", qtype, qclassInfo)
-
-    query = headerData + question
+    # The OPT record (RFC 6891) lets the resolver send replies of up to EDNS_PAYLOAD bytes
+    # over UDP instead of 512.
+    query = encodeQuery(qtype, queryName, qclass['IN'], 0, EDNS_PAYLOAD)
 
     # FORMERR query for testing
     # query = b'\x01\x00\x01\x00\x00\x01\x00\x00\x00\x00\x03www\x06example\x03com\x00\x00\x01\x00\x01'
 
     return query
-def encodePTRName(ipAdresss):
-    ipBytes = ipAdresss.split('.')
-
-    ipBytes.reverse()
-
-    name = b''
-
-    for x in ipBytes:
-        length = len(x)
-        name += struct.pack('!B', length) + x.encode()
-
-    length = len("IN-ADDR")
-    name += struct.pack('!B', length) + "IN-ADDR".encode()
-
-    length = len("ARPA")
-    name += struct.pack('!B', length) + "ARPA".encode()
-
-    name += b'\x00'
-
-    return name
 
 def printResponse(response):
     pp = pprint.PrettyPrinter(indent=2)
@@ -205,9 +124,12 @@ def printResponse(response):
         ansTTL = ansExtras["ansTTL"]
         ansRdlength = ansExtras["ansRdlength"]
 
+        ansName = ansExtras["ansName"]
+
         answer = data['answers'][count]
-        if ansType == qType:
-            print(f"{name}\t{ansTTL}\t{invertedClasses[ansClass]}\t{invertedTypes[ansType]}\t{answer}")
+        # CNAME rows show the chain the resolver followed to the answer, alias by alias.
+        if ansType == qType or ansType == types['CNAME']:
+            print(f"{ansName}\t{ansTTL}\t{invertedClasses[ansClass]}\t{invertedTypes[ansType]}\t{answer}")
     print("\n")
     print("AUTHORITY SECTION:")
     for count in range(0, nsCount):
@@ -219,6 +141,27 @@ def printResponse(response):
 
         answer = data['ns'][count]
         print(f"{name}\t{authTTL}\t{invertedClasses[authClass]}\t{invertedTypes[authType]}\t{answer}")
+def receiveExactly(sock, length):
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if len(chunk) == 0:
+            raise ConnectionError("connection closed by resolver")
+        data += chunk
+    return data
+
+def queryTcp(query):
+    # Repeats a query whose UDP reply was truncated over TCP (RFC 7766 Section 5), where
+    # messages are prefixed with their length (RFC 1035 Section 4.2.2).
+    with socket.create_connection((resolverIP, int(resolverPort)), float(timeout)) as tcpClient:
+        tcpClient.sendall(struct.pack('!H', len(query)) + query)
+        length = struct.unpack('!H', receiveExactly(tcpClient, 2))[0]
+        return receiveExactly(tcpClient, length)
+
+if '--batch' in sys.argv:
+    batchMain(sys.argv[1:])
+    sys.exit()
+
 if len(sys.argv) < 5:
     print("Error: invalid arguments\nUsage: python3 Client.py [resolver_ip] [resolver_port] [name] [type] [timeout=5]", file=sys.stderr)
     sys.exit()
@@ -242,9 +185,10 @@ client.settimeout(float(timeout))
 
 timeStart = time.time()
 # UDP is connectionless so no connecting to server like with TCP.
-client.sendto(createQuery(queryTypeArg), (resolverIP, int(resolverPort)))
+query = createQuery(queryTypeArg)
+client.sendto(query, (resolverIP, int(resolverPort)))
 try:
-    modifiedMessage, serverAddress = client.recvfrom(2048)
+    modifiedMessage, serverAddress = client.recvfrom(MAX_MESSAGE)
     timeEnd = time.time()
 except socket.timeout:
     timeEnd = time.time()
@@ -252,6 +196,13 @@ except socket.timeout:
     print(f"\nQuery time: {round(timeEnd - timeStart, 4)} sec")
     exit()
 
+if len(modifiedMessage) >= 12 and struct.unpack('!H', modifiedMessage[2:4])[0] & TC:
+    try:
+        modifiedMessage = queryTcp(query)
+    except OSError as error:
+        print(f"WARNING: Reply truncated and retrying over TCP failed ({error}), showing the truncated reply.")
+    timeEnd = time.time()
+
 if len(modifiedMessage) < 12:
     print("ERROR TIMEOUT: All DNS Servers contacted by resolver timed out.")
     print(f"\nQuery time: {round(timeEnd - timeStart, 4)} sec")
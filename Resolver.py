@@ -1,175 +1,976 @@
+import argparse
+import asyncio
+import signal
 import socket
 import sys
 import struct
-from helpers import parseResponse, createQuery, resolverIntermediaryQuery
-import copy
-
-def checkIfAnswer(response):
-    if len(response) < 12:
+import time
+from helpers import createQuery, questionKey, questionBytes, types, qclass, rcodeTypes
+from message import parseMessage, Message, OPT_TYPE
+from encoder import sharedEncoder, createQuery as encodeQuery, QR, AA, TC, RD, RECORD, EDNS_PAYLOAD, MAX_UDP_MESSAGE, MAX_MESSAGE
+from upstream import UpstreamTransport, UPSTREAM_SOCKETS, DNS_PORT
+from connectionPool import ConnectionPool
+from admission import AdmissionControl, MAX_ACTIVE, MAX_QUEUED
+from metrics import Metrics, renderMetrics, serveMetrics
+from serverSelection import ServerSelector, HedgeBudget, HEDGE_RATIO
+from cache import AnswerCache, DelegationCache, isSubdomain, ANY_TYPE, MAX_ENTRIES, MAX_BYTES, MAX_STALE
+from sharedCache import SharedAnswerStore, SHARED_CACHE_MB
+from supervisor import runSupervisor
+from snapshot import loadSnapshot, saveSnapshot, restoreDelegations, SNAPSHOT_INTERVAL
+
+# Upper bound on referrals followed for a single question, stops delegation loops.
+MAX_REFERRALS = 30
+
+# Upper bound on nested glueless NS lookups (a lookup needed to find a nameserver, which
+# itself needs a lookup, ...).
+MAX_DEPTH = 4
+
+# Prefetch: a cache hit on an entry in the last PREFETCH_FRACTION of its TTL refreshes it in
+# the background (as Unbound does), if the entry has had PREFETCH_HITS hits and a TTL of at
+# least PREFETCH_MIN_TTL seconds (BIND's eligibility threshold).
+PREFETCH_FRACTION = 0.1
+PREFETCH_HITS = 2
+PREFETCH_MIN_TTL = 10
+
+# Root priming (RFC 8109): the root NS set is refreshed when PRIME_REFRESH of its TTL has
+# passed, and after a failed priming query every PRIME_RETRY seconds.
+PRIME_REFRESH = 0.9
+PRIME_RETRY = 60
+
+# Serve-stale (RFC 8767 Section 4 and 5): stale answers carry STALE_TTL, and after a failed
+# refresh the stale entry is served without trying again for STALE_REFRESH seconds.
+STALE_TTL = 30
+STALE_REFRESH = 30
+
+# CNAME chains are followed by the resolver for up to MAX_CNAME_CHAIN aliases, longer chains
+# and loops are answered with SERVFAIL.
+MAX_CNAME_CHAIN = 10
+CNAME_TYPE = 5
+ANY_QTYPE = 255
+FORMERR = 1
+SERVFAIL = 2
+
+# DNS over TCP (RFC 7766): connections without outstanding queries are closed after
+# TCP_IDLE_TIMEOUT seconds (Section 6.2.3), each connection has up to TCP_PIPELINE queries
+# being resolved at once, and up to TCP_CONNECTIONS clients can be connected.
+TCP_IDLE_TIMEOUT = 10
+TCP_PIPELINE = 100
+TCP_CONNECTIONS = 500
+
+# Receive buffer of the UDP socket, so a burst of queries waits in the kernel for admission
+# instead of being dropped there (Linux caps it at net.core.rmem_max).
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+# Extended RCODE BADVERS (RFC 6891 Section 9), for clients using an EDNS version other than 0.
+BADVERS = 16
+
+def sectionRecords(section, ansType):
+    # Returns the records of type ansType in a section of a parsed message.
+    return [record for record in section if record.rtype == ansType]
+
+def answerFor(clientQuery, message):
+    # Returns the reply message with the client's transaction ID and question section. The
+    # question only differs in name case, the name has the same length, so compression
+    # pointers into it stay valid. The server's OPT record is for the resolver and is taken
+    # out, by cutting it off the end where servers put it, or else by encoding the rest again.
+    response = message.wire
+    opt = message.opt
+    if opt is not None:
+        if opt.rdataOffset + opt.rdlength != message.end:
+            return encodeCachedAnswer(clientQuery, message, 0, keepFlags=True)
+        response = response[0:10] + struct.pack('!H', len(message.additional) - 1) + response[12:opt.nameOffset]
+    questionEnd = 12 + len(questionBytes(clientQuery))
+    return clientQuery[0:2] + response[2:12] + clientQuery[12:questionEnd] + response[questionEnd:]
+
+def encodeCachedAnswer(clientQuery, entry, age, staleTtl=None, keepFlags=False):
+    # Synthesizes the answer to clientQuery from a cache entry. TTLs are reduced by the time
+    # spent in the cache, or all set to staleTtl for a stale answer, AA is cleared as cached
+    # data is not authoritative (RFC 1035 Section 6.1), and RD is copied from the query.
+    # With keepFlags entry is a fresh reply, whose flags are passed on as they are.
+    clientFlags = struct.unpack('!H', clientQuery[2:4])[0]
+    flags = entry.flags if keepFlags else (entry.flags & ~(AA | TC | RD)) | (clientFlags & RD) | QR
+    sharedEncoder.begin(struct.unpack('!H', clientQuery[0:2])[0], flags)
+    sharedEncoder.addRawQuestion(clientQuery[12:12 + len(questionBytes(clientQuery))])
+    for section, records in ((1, entry.answers), (2, entry.authority), (3, entry.additional)):
+        for record in records:
+            if record.rtype != OPT_TYPE:
+                sharedEncoder.addRecord(section, record, max(record.ttl - age, 0) if staleTtl is None else staleTtl)
+    return sharedEncoder.finish()
+
+def followChain(answers, qname, qtype, names):
+    # Follows the CNAME records of an answer section from qname. Every alias followed is
+    # added to the list names. Returns (the name the chain ends at, whether answers has
+    # records of qtype for it), or None if the chain loops.
+    name = qname
+    while True:
+        cname = None
+        for record in answers:
+            if record.name == name:
+                if record.rtype == qtype:
+                    return (name, True)
+                if record.rtype == CNAME_TYPE:
+                    cname = record
+        if cname is None:
+            return (name, False)
+        names.append(name)
+        name = cname.target()
+        if name in names:
+            return None
+
+def inZone(message, qname, qtype, zone):
+    # Returns the part of a final reply from a server for zone that the resolver trusts: a
+    # server is only authoritative for names in its own zone (RFC 2181 Section 5.4.1).
+    # Answer records for names outside zone are dropped, so a CNAME chain stops at the first
+    # target outside it and chaseChain resolves that target on its own. An NXDOMAIN for such
+    # a target is kept as a NOERROR answer of the aliases alone.
+    answers = [record for record in message.answers if isSubdomain(record.name, zone)]
+    if len(answers) < len(message.answers):
+        message = Message(message.data, message.id, message.flags, message.questions, answers,
+            message.authority, message.additional, message.end)
+    if message.rcode == 3 and len(message.answers) > 0:
+        names = []
+        end = followChain(message.answers, qname, qtype, names)
+        if end is not None and len(names) > 0 and not isSubdomain(end[0], zone):
+            aliases = [record for record in message.answers if record.rtype == CNAME_TYPE and record.name in names]
+            return Message(message.data, message.id, message.flags & ~0xF, message.questions, aliases, [], [], message.end)
+    return message
+
+def isAlias(segment, qtype):
+    # Whether an answer may be a CNAME chain the resolver has to follow.
+    if qtype == CNAME_TYPE or qtype == ANY_QTYPE or segment.flags & 0xF != 0:
         return False
-    byteHeader = response[0:12] # First 12 bytes are the header as specified by RFC 1035.
-
-    unpackedHeader = struct.unpack('!HHHHHH', byteHeader) # Get header
-
-    qCount, ansCount, nsCount, arCount = unpackedHeader[2:] # Pos 0 is ID, Pos 1 is Flags, Pos 2-5 is counts
-
-    if ansCount > 0:
-        return True
-    # elif ansCount == 0 and nsCount > 0 and arCount == 0:
-    #     return True # If answer in ns section from NS query, and no additional section
-    #     # There is no next server to go to and the answer is in NS section.
-    return False
-
-if len(sys.argv) < 2 or len(sys.argv) > 3:
-    print("Error: invalid arguments\nUsage: python3 Resolver.py [resolver_port] [timeout=5]", file=sys.stderr)
-    sys.exit()
-serverPort = int(sys.argv[1])
-
-# Note: Confirmed that client and resolver timeouts dont have to match:
-# https://edstem.org/au/courses/11968/discussion/1467216
-# Implementation based on this assumption as not specified otherwise in specification:
-if len(sys.argv) > 2:
-    timeout = sys.argv[2]
-else:
-    timeout = 5
-
-serverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-dnsSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-serverSocket.bind(('localhost', serverPort))
-
-clientAddress = None
-
-clientQuery = None
-
-dnsSocket.settimeout(float(timeout))
-
-encounteredAnswers = []
-
-# Reference: File reading format obtained from:
-# https://stackoverflow.com/questions/15599639/what-is-the-perfect-counterpart-in-python-for-while-not-eof
-# By dawg
-
-rootServers = []
-
-currServer = None
-
-timeOut = False
-
-prevData = None
+    return any([record.rtype == CNAME_TYPE for record in segment.answers])
+
+def encodeChain(clientQuery, segments, rcode):
+    # Synthesizes one answer to clientQuery from the answers for every name of a CNAME chain,
+    # segments being (cache entry or reply, age) in chain order. The authority and
+    # additional sections are those of the last name, whose RCODE the answer carries unless
+    # the chain failed (RFC 6604 Section 3).
+    clientFlags = struct.unpack('!H', clientQuery[2:4])[0]
+    flags = (segments[-1][0].flags & ~(AA | TC | RD | 0xF)) | (clientFlags & RD) | QR | rcode
+    sharedEncoder.begin(struct.unpack('!H', clientQuery[0:2])[0], flags)
+    sharedEncoder.addRawQuestion(clientQuery[12:12 + len(questionBytes(clientQuery))])
+    for segment, age in segments:
+        for record in segment.answers:
+            sharedEncoder.addRecord(1, record, max(record.ttl - age, 0))
+    segment, age = segments[-1]
+    if rcode != SERVFAIL:
+        for section, records in ((2, segment.authority), (3, segment.additional)):
+            for record in records:
+                if record.rtype != OPT_TYPE:
+                    sharedEncoder.addRecord(section, record, max(record.ttl - age, 0))
+    return sharedEncoder.finish()
+
+def errorAnswer(clientQuery, rcode):
+    # Answer to clientQuery with no records and the given RCODE.
+    sharedEncoder.begin(struct.unpack('!H', clientQuery[0:2])[0], QR | (struct.unpack('!H', clientQuery[2:4])[0] & RD) | rcode)
+    sharedEncoder.addRawQuestion(clientQuery[12:12 + len(questionBytes(clientQuery))])
+    return sharedEncoder.finish()
+
+def formatError(clientQuery):
+    # FORMERR answer to a query the resolver could not make sense of, with its question if
+    # that at least can be read and with only the header otherwise.
+    try:
+        return errorAnswer(clientQuery, FORMERR)
+    except (struct.error, IndexError, ValueError):
+        sharedEncoder.begin(struct.unpack('!H', clientQuery[0:2])[0], QR | (struct.unpack('!H', clientQuery[2:4])[0] & RD) | FORMERR)
+        return sharedEncoder.finish()
+
+def clientEdns(clientQuery):
+    # Returns (UDP payload size, EDNS version) from the OPT record of a client query, or
+    # None if the client does not use EDNS0.
+    if clientQuery[10:12] == b'\x00\x00':
+        return None
+    try:
+        opt = parseMessage(clientQuery).opt
+    except ValueError:
+        return None
+    if opt is None:
+        return None
+    return (opt.rclass, (opt.ttl >> 16) & 0xFF)
+
+def withOpt(response, payload, extendedRcode=0):
+    # Appends an OPT record advertising payload to an encoded response.
+    arcount = struct.unpack_from('!H', response, 10)[0]
+    return (response[0:10] + struct.pack('!H', arcount + 1) + response[12:] + b'\x00' +
+        RECORD.pack(OPT_TYPE, payload, extendedRcode << 24, 0))
+
+def truncated(clientQuery, response):
+    # The header and question of response with TC set, telling the client to ask again over
+    # TCP (RFC 2181 Section 9).
+    questionEnd = 12 + len(questionBytes(clientQuery))
+    flags = struct.unpack_from('!H', response, 2)[0] | TC
+    return response[0:2] + struct.pack('!HHHHH', flags, 1, 0, 0, 0) + response[12:questionEnd]
+
+def readRootHints(fileName):
+    # Returns the A and AAAA addresses of the root servers listed in a hints file such as
+    # named.root, whose records are "name ttl [class] type data" with ';' comments.
+    rootServers = []
+    with open(fileName, 'r') as f:
+        for line in f:
+            data = line.split(';')[0].split()
+            if len(data) >= 4 and (data[-2] == 'A' or data[-2] == 'AAAA'):
+                rootServers.append(data[-1])
+    return rootServers
+
+class Resolver:
+
+    def __init__(self, rootServers, timeout, answerCache=None, delegationCache=None, hedgeRatio=HEDGE_RATIO, upstreamPort=DNS_PORT,
+            prefetch=True, ednsPayload=EDNS_PAYLOAD, admission=None):
+        # Addresses from the root hints, used until priming succeeds and whenever the primed
+        # root set has expired. Upstream sockets are IPv4, so AAAA roots are kept in the hints
+        # but not queried.
+        self.rootHints = rootServers
+        self.rootServers = [address for address in rootServers if ':' not in address]
+        self.rootsExpire = 0.0
+        self.primes = 0
+        self.primeTask = None
+        self.timeout = timeout
+        self.selector = ServerSelector(timeout)
+        # UDP payload size advertised upstream and to clients using EDNS0, 0 disables EDNS0.
+        self.ednsPayload = ednsPayload
+        # TCP connections to a server are shared by every query that needs one.
+        self.tcpPool = ConnectionPool(upstreamPort, self.selector)
+        self.upstream = UpstreamTransport(UPSTREAM_SOCKETS, upstreamPort, ednsPayload, self.tcpPool)
+        # Glueless NS lookups run on their own sockets, apart from the client queries that
+        # needed them.
+        self.glueUpstream = UpstreamTransport(UPSTREAM_SOCKETS, upstreamPort, ednsPayload, self.tcpPool)
+        self.answerCache = answerCache if answerCache is not None else AnswerCache()
+        self.delegationCache = delegationCache if delegationCache is not None else DelegationCache()
+        self.hedgeBudget = HedgeBudget(hedgeRatio)
+        # Bounds the resolutions started for client queries, queries waiting past the
+        # timeout are dropped.
+        self.admission = admission if admission is not None else AdmissionControl(maxWait=timeout)
+        self.backgroundTasks = set()
+        # (qname, qtype, qclass) -> task resolving it for client queries. Glueless NS lookups
+        # are not coalesced, so a walk can never end up waiting on itself.
+        self.inflight = {}
+        self.coalesced = 0
+        self.prefetch = prefetch
+        self.prefetches = 0
+        self.staleAnswers = 0
+        self.truncatedAnswers = 0
+        self.cnameLookups = 0
+        self.cnameFailures = 0
+        self.metrics = Metrics()
+
+    async def open(self):
+        await self.upstream.open()
+        await self.glueUpstream.open()
+        self.tcpPool.start()
+
+    def close(self):
+        if self.primeTask is not None:
+            self.primeTask.cancel()
+        self.upstream.close()
+        self.glueUpstream.close()
+        self.tcpPool.close()
+
+    def startPriming(self):
+        # Primes the root NS set at startup and keeps it fresh in the background. Client
+        # queries arriving before the first priming answer use the hints.
+        self.primeTask = asyncio.ensure_future(self.refreshRoots())
+
+    async def refreshRoots(self):
+        while True:
+            ttl = await self.prime()
+            await asyncio.sleep(ttl * PRIME_REFRESH if ttl is not None else PRIME_RETRY)
+
+    def roots(self):
+        # Current root server addresses, ranked.
+        if self.rootsExpire <= time.time():
+            self.rootServers = [address for address in self.rootHints if ':' not in address]
+        return self.selector.rank(self.rootServers)
+
+    async def prime(self):
+        # Priming query as specified by RFC 8109: ". NS" to a root server, whose answer lists
+        # the current root servers and their addresses. Returns the TTL of the root NS set,
+        # or None if priming failed and the hints stay in use.
+        query = createQuery('NS', '.')
+        servers = self.roots()
+        while len(servers) > 0:
+            response, currServer = await self.queryServers(query, servers, self.upstream)
+            if response is None:
+                continue
+            try:
+                message = parseMessage(response)
+                message.check()
+            except ValueError:
+                self.selector.recordFailure(currServer)
+                continue
+            nsRecords = [record for record in sectionRecords(message.answers, types['NS']) if record.name == '.']
+            if rcodeTypes.get(message.rcode) != 'NOERROR' or len(nsRecords) == 0:
+                self.selector.recordFailure(currServer)
+                continue
+            self.selector.recordSuccess(currServer)
+
+            nsNames = [record.target() for record in nsRecords]
+            glueRecords = [record for record in sectionRecords(message.additional, types['A']) if record.name in nsNames]
+            if len(glueRecords) == 0:
+                continue # Truncated before the addresses, RFC 8109 Section 4.2.
+            ttl = min([record.ttl for record in nsRecords + glueRecords])
+            self.rootServers = list(set([record.address() for record in glueRecords]))
+            self.rootsExpire = time.time() + ttl
+            self.primes += 1
+            return ttl
+        return None
+
+    async def resolve(self, clientQuery, udp=True, client=None):
+        # Resolves a client query from the address client and returns the message to send
+        # back, carrying the client's own transaction ID.
+        start = time.perf_counter()
+        response = await self.respond(clientQuery, udp, client)
+        self.metrics.recordResponse(response, time.perf_counter() - start, udp)
+        return response
+
+    async def respond(self, clientQuery, udp, client):
+        # Clients using EDNS0 get an OPT record back (RFC 6891
+        # Section 7), and replies over UDP that do not fit the client's payload size, or 512
+        # bytes without EDNS0, are truncated.
+        edns = clientEdns(clientQuery) if self.ednsPayload > 0 else None
+        if edns is not None and edns[1] != 0:
+            return withOpt(errorAnswer(clientQuery, 0), self.ednsPayload, BADVERS >> 4)
+
+        response = await self.answer(clientQuery, client)
+        if len(response) < 12:
+            return response
+        limit = MAX_MESSAGE if not udp else MAX_UDP_MESSAGE
+        if edns is not None:
+            response = withOpt(response, self.ednsPayload)
+            if udp:
+                limit = max(min(edns[0], self.ednsPayload), MAX_UDP_MESSAGE)
+        if len(response) > limit:
+            self.truncatedAnswers += 1
+            response = truncated(clientQuery, response)
+            if edns is not None:
+                response = withOpt(response, self.ednsPayload)
+        return response
+
+    async def answer(self, clientQuery, client):
+        key = questionKey(clientQuery)
+        cached = self.answerCache.get(key)
+        if cached is not None:
+            if self.prefetch:
+                self.prefetchEntry(key, clientQuery, cached[0])
+            if isAlias(cached[0], key[1]):
+                start = time.perf_counter()
+                response = await self.chaseChain(clientQuery, key, cached, client)
+                self.metrics.record('cname', time.perf_counter() - start)
+                return response
+            return encodeCachedAnswer(clientQuery, cached[0], cached[1])
+
+        stale = self.answerCache.getStale(key)
+        if stale is not None and time.time() - stale[0].failed < STALE_REFRESH:
+            self.staleAnswers += 1
+            return encodeCachedAnswer(clientQuery, stale[0], stale[1], STALE_TTL)
+
+        # Clients asking a question that is already being resolved wait for that resolution
+        # instead of starting their own walk, and each gets the result under its own ID.
+        pending = self.inflight.get(key)
+        if pending is None:
+            pending = await self.admitResolution(key, clientQuery, client)
+            if pending is None:
+                return self.shedAnswer(clientQuery, key)
+        else:
+            self.coalesced += 1
+        message = await asyncio.shield(pending)
+
+        if message is None or rcodeTypes.get(message.rcode) == 'SERVFAIL':
+            stale = self.answerCache.getStale(key)
+            if stale is not None:
+                stale[0].failed = time.time()
+                self.staleAnswers += 1
+                return encodeCachedAnswer(clientQuery, stale[0], stale[1], STALE_TTL)
+        if message is None:
+            return "timeout".encode() # All servers exhausted.
+        if isAlias(message, key[1]):
+            start = time.perf_counter()
+            response = await self.chaseChain(clientQuery, key, (message, 0), client)
+            self.metrics.record('cname', time.perf_counter() - start)
+            return response
+        return answerFor(clientQuery, message)
+
+    async def admitResolution(self, key, clientQuery, client):
+        # Starting a resolution takes one of the admission slots of client, until it is done.
+        # Returns the resolution of key, possibly one started while this query waited, or
+        # None if the query was shed.
+        start = time.perf_counter()
+        admitted = await self.admission.acquire(client)
+        self.metrics.record('queue', time.perf_counter() - start)
+        if not admitted:
+            return None
+        pending = self.inflight.get(key)
+        if pending is None:
+            pending = self.startResolution(key, clientQuery)
+            pending.add_done_callback(lambda task: self.admission.release())
+        else:
+            self.admission.release()
+            self.coalesced += 1
+        return pending
+
+    async def chaseChain(self, clientQuery, key, first, client):
+        # Follows a CNAME chain for the client (RFC 1034 Section 5.3.3, step 4c), so it gets
+        # the records it asked for with one query. Every name of the chain is answered and
+        # cached on its own, as its links can have different TTLs and lie in different zones:
+        # the answer for the next name comes from the cache when possible and is otherwise
+        # resolved like a client question from client, sharing a resolution already in
+        # progress. first is (cache entry or reply, age) of the answer for the name asked.
+        qtype, qclassInfo = key[1], key[2]
+        segments = [first]
+        names = []
+        name = key[0]
+        while True:
+            segment = segments[-1][0]
+            aliases = len(names)
+            end = followChain(segment.answers, name, qtype, names)
+            if end is None or len(names) > MAX_CNAME_CHAIN:
+                self.cnameFailures += 1
+                return encodeChain(clientQuery, segments, SERVFAIL) # Loop or overlong chain.
+            name, complete = end
+            if complete or len(names) == aliases or segment.flags & 0xF != 0:
+                return encodeChain(clientQuery, segments, segment.flags & 0xF)
+
+            targetKey = (name, qtype, qclassInfo)
+            cached = self.answerCache.get(targetKey)
+            if cached is not None:
+                segments.append(cached)
+                continue
+            pending = self.inflight.get(targetKey)
+            if pending is None:
+                # Names of the chain count against the admission limits of client too.
+                pending = await self.admitResolution(targetKey, encodeQuery(qtype, name, qclassInfo), client)
+                if pending is None:
+                    self.cnameFailures += 1
+                    return encodeChain(clientQuery, segments, SERVFAIL)
+            self.cnameLookups += 1
+            message = await asyncio.shield(pending)
+            if message is None:
+                self.cnameFailures += 1
+                return encodeChain(clientQuery, segments, SERVFAIL)
+            segments.append((message, 0))
+
+    def shedAnswer(self, clientQuery, key):
+        # Answer to a query turned away for lack of capacity: stale data if there is any
+        # (RFC 8767 Section 5), otherwise an immediate SERVFAIL, so the client can move on
+        # instead of waiting out its timeout.
+        stale = self.answerCache.getStale(key)
+        if stale is not None:
+            self.staleAnswers += 1
+            return encodeCachedAnswer(clientQuery, stale[0], stale[1], STALE_TTL)
+        return errorAnswer(clientQuery, SERVFAIL)
+
+    def startResolution(self, key, clientQuery):
+        task = asyncio.ensure_future(self.resolveUncached(key, clientQuery))
+        self.inflight[key] = task
+        task.add_done_callback(lambda task: self.inflight.pop(key, None))
+        return task
+
+    def prefetchEntry(self, key, clientQuery, entry):
+        # Refreshes a popular entry close to expiry in the background, so its clients never
+        # see it expire.
+        ttl = entry.expires - entry.stored
+        if entry.hits < PREFETCH_HITS or ttl < PREFETCH_MIN_TTL or key in self.inflight:
+            return
+        if entry.expires - time.time() > ttl * PREFETCH_FRACTION:
+            return
+        if not self.admission.tryAcquireLowPriority():
+            return # Busy with client queries, the entry can expire normally.
+        self.prefetches += 1
+        task = self.startResolution(key, clientQuery)
+        task.add_done_callback(lambda task: self.admission.release())
+        self.runInBackground([task])
+
+    async def resolveUncached(self, key, clientQuery):
+        start = time.perf_counter()
+        message = await self.iterate(clientQuery, 0)
+        self.metrics.record('resolution', time.perf_counter() - start)
+        if message is not None:
+            self.cacheAnswer(key, message)
+        return message
+
+    def cacheAnswer(self, key, message):
+        # Positive answers are cached for the smallest TTL in their answer section. Negative
+        # answers are cached as specified by RFC 2308 Section 5, for the smaller of the TTL
+        # and MINIMUM field of the SOA record in their authority section.
+        if message.tc == 1:
+            return
+        rcode = rcodeTypes.get(message.rcode)
+        if rcode == 'NOERROR' and len(message.answers) > 0:
+            ttl = min([record.ttl for record in message.answers])
+            self.answerCache.put(key, message, ttl)
+            return
+
+        soaRecords = sectionRecords(message.authority, types['SOA'])
+        if len(soaRecords) == 0:
+            return # Without an SOA record there is no negative TTL, RFC 2308 Section 5.
+        ttl = min(soaRecords[0].ttl, soaRecords[0].soa()[6])
+        if rcode == 'NXDOMAIN':
+            names = []
+            end = followChain(message.answers, key[0], key[1], names)
+            if end is None:
+                return
+            if len(names) > 0:
+                # The NXDOMAIN is about the name the CNAME chain ends at, not qname (RFC 6604
+                # Section 2.1). The aliases are cached as the answer for qname, which chaseChain
+                # follows to the negative entry of the last name. That entry is only made
+                # for a name inside the zone of the SOA record, iterate having checked the
+                # name is inside the zone of the server too (inZone), so no server can deny
+                # names of another zone.
+                aliases = [record for record in message.answers if record.rtype == CNAME_TYPE and record.name in names]
+                self.answerCache.put(key, Message(message.data, message.id, message.flags & ~0xF, message.questions,
+                    aliases, [], [], message.end), min([record.ttl for record in aliases]))
+                if not isSubdomain(end[0], soaRecords[0].name):
+                    return
+                message = Message(message.data, message.id, message.flags, message.questions, [],
+                    message.authority, message.additional, message.end)
+            self.answerCache.putNegative((end[0], ANY_TYPE, key[2]), message, ttl)
+        elif rcode == 'NOERROR' and len(sectionRecords(message.authority, types['NS'])) == 0:
+            self.answerCache.putNegative(key, message, ttl) # NODATA, RFC 2308 Section 2.2.
+
+    async def iterate(self, query, depth):
+        # Iterative resolution as specified by RFC 1034 Section 5.3.3, starting at the deepest
+        # cached zone cut and following referrals until an answer or an error is returned.
+        # Returns the parsed final message, or None if every server timed out.
+        qname, qtype = questionKey(query)[0:2]
+        closest = self.delegationCache.findClosest(qname)
+        if closest is not None:
+            zone, servers = closest[0], self.selector.rank(closest[1])
+        else:
+            zone, servers = '.', self.roots()
+        lastMessage = None
+        referrals = 0
+        upstream = self.upstream if depth == 0 else self.glueUpstream
+        walk = 'client' if depth == 0 else 'glue'
+        self.metrics.walks[walk] += 1
+        # Lookups of the other nameservers of a glueless zone, still running.
+        glueLookups = set()
+
+        while referrals < MAX_REFERRALS:
+            if len(servers) == 0 and len(glueLookups) > 0:
+                # Every address found so far failed, try the nameservers found since.
+                done, glueLookups = await asyncio.wait(glueLookups, return_when=asyncio.FIRST_COMPLETED)
+                servers = self.selector.rank([address for task in done if not task.cancelled()
+                    for address in task.result()[0] if address not in candidates])
+                candidates.update(servers)
+                continue
+            if len(servers) == 0:
+                if zone == '.' or closest is None:
+                    break
+                # Every server of a cached delegation failed, start again from the roots.
+                closest = None
+                zone, servers = '.', self.roots()
+            response, currServer = await self.queryServers(query, servers, upstream)
+            if response is None:
+                continue # Timed out, fall back to the next server for this zone.
+            parseStart = time.perf_counter()
+            try:
+                message = parseMessage(response)
+                # Names and RDATA are decoded lazily, by the referral, the cache and CNAME
+                # chasing. Checking them here makes a malformed record fail this server only,
+                # not the whole resolution and every query waiting on it.
+                message.check()
+            except ValueError:
+                self.selector.recordFailure(currServer)
+                continue # Malformed reply, treat the server like it failed.
+            self.metrics.record('parse', time.perf_counter() - parseStart)
+
+            rcode = rcodeTypes.get(message.rcode)
+            # If some issue occurs with the server, exhaust all ips
+            if rcode == 'SERVFAIL' or rcode == 'REFUSED':
+                self.selector.recordFailure(currServer)
+                lastMessage = message
+                continue
+            self.selector.recordSuccess(currServer)
+
+            message = inZone(message, qname, qtype, zone)
+            if len(message.answers) > 0:
+                return message
+            if rcode == 'NXDOMAIN' or rcode == 'FORMERR':
+                return message
+
+            nsRecords = sectionRecords(message.authority, types['NS'])
+            if len(nsRecords) == 0:
+                return message # No answer and no referral, e.g. the name exists without this type.
+
+            # Only follow referrals to a zone below the one currServer is serving that still
+            # contains qname, anything else is a lame or bogus delegation.
+            childZone = nsRecords[0].name
+            if childZone == zone or not isSubdomain(childZone, zone) or not isSubdomain(qname, childZone):
+                lastMessage = message
+                continue
+
+            referrals += 1
+            self.metrics.referrals[walk] += 1
+            # Glue is only taken for the NS names of the referral and from within the zone
+            # currServer is authoritative for (its bailiwick), so a server can not plant
+            # addresses for names outside its own zone.
+            bailiwick = zone
+            zone = childZone
+            glueLookups = set()
+            nsNames = [record.target() for record in nsRecords]
+            glueRecords = [record for record in sectionRecords(message.additional, types['A'])
+                if record.name in nsNames and isSubdomain(record.name, bailiwick)]
+            glue = [record.address() for record in glueRecords]
+            ttl = min([record.ttl for record in nsRecords + glueRecords])
+            self.delegationCache.put(zone, nsNames, glue, ttl)
+            if len(glue) > 0:
+                servers = self.selector.rank(glue)
+                continue
+
+            # If currServer doesnt have IP address information, get it ourselves
+            glueStart = time.perf_counter()
+            addresses, glueLookups = await self.resolveNameservers(zone, nsNames, ttl, depth + 1)
+            self.metrics.record('glue', time.perf_counter() - glueStart)
+            if currServer in addresses:
+                addresses.remove(currServer) # Avoid self loop
+            candidates = set(addresses)
+            candidates.add(currServer)
+            if len(addresses) > 0:
+                servers = self.selector.rank(addresses)
+            else:
+                # The other servers of the parent zone would only repeat the referral.
+                servers = []
+                lastMessage = message
+
+        return lastMessage
+
+    async def queryServers(self, query, servers, upstream):
+        # Queries the best of servers. While it stays silent past its hedge delay the
+        # question is also sent to the next best server, within the hedge budget. Returns
+        # (reply, server) for the first reply, or (None, None) once every server queried has
+        # timed out. Queried servers are removed from servers.
+        currServer = servers.pop(0)
+        pending = {asyncio.ensure_future(self.queryServer(query, currServer, upstream)): currServer}
+        self.hedgeBudget.addQuery()
+
+        while len(pending) > 0:
+            delay = None
+            if len(servers) > 0 and self.hedgeBudget.available():
+                delay = self.selector.hedgeDelay(currServer)
+            done, notDone = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+            if len(done) == 0:
+                if self.hedgeBudget.take():
+                    currServer = servers.pop(0)
+                    pending[asyncio.ensure_future(self.queryServer(query, currServer, upstream))] = currServer
+                continue
+
+            for task in done:
+                server = pending.pop(task)
+                response = task.result()
+                if response is not None:
+                    # Slower queries are left to finish in the background so their
+                    # servers' RTT estimates still get updated.
+                    self.runInBackground(pending)
+                    return (response, server)
+        return (None, None)
+
+    def runInBackground(self, tasks):
+        for task in tasks:
+            self.backgroundTasks.add(task)
+            task.add_done_callback(self.backgroundTasks.discard)
+
+    async def queryServer(self, query, server, upstream):
+        # Sends query to server, waiting for its current RTO, and feeds the outcome into its
+        # SRTT, RTT variance and backoff.
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        response = await upstream.query(query, server, self.selector.rto(server))
+        if response is None:
+            self.selector.recordTimeout(server)
+            self.metrics.recordTimeout(server)
+            return None
+        self.selector.recordRtt(server, loop.time() - start)
+        self.metrics.record('upstream', loop.time() - start)
+        if response[2] & (TC >> 8):
+            # Truncated even at the EDNS0 payload size, ask the same server over TCP (RFC
+            # 7766 Section 5) rather than act on a partial referral or answer. The pool
+            # records the outcome with the selector.
+            start = loop.time()
+            response = await upstream.queryTcp(query, server, self.timeout)
+            self.metrics.record('tcp', loop.time() - start)
+        return response
+
+    async def resolveNameservers(self, zone, nsNames, ttl, depth):
+        # Resolves the addresses of a delegation that came without glue. Every NS name is
+        # looked up at once and the first addresses found are returned with the lookups still
+        # running, which finish in the background and add their addresses to the delegation
+        # cache too. Names inside zone itself can not be resolved without glue and are skipped.
+        # Under pressure the lookups yield: they run one at a time and stop at the first
+        # addresses found.
+        names = [nsName for nsName in nsNames if not isSubdomain(nsName, zone)]
+        lookups = set()
+
+        while len(lookups) > 0 or len(names) > 0:
+            while len(names) > 0 and (len(lookups) == 0 or not self.admission.underPressure()):
+                lookups.add(asyncio.ensure_future(self.resolveAddresses(names.pop(0), depth)))
+            done, lookups = await asyncio.wait(lookups, return_when=asyncio.FIRST_COMPLETED)
+            found = []
+            for task in done:
+                addresses, addressTtl = task.result()
+                if len(addresses) > 0:
+                    self.delegationCache.addAddresses(zone, addresses, min(ttl, addressTtl))
+                    found += addresses
+            if len(found) > 0 and self.admission.underPressure():
+                for other in lookups:
+                    other.cancel()
+                return (found, set())
+            if len(found) > 0:
+                for other in lookups:
+                    other.add_done_callback(lambda other: self.cacheNameserver(zone, ttl, other))
+                self.runInBackground(lookups)
+                return (found, lookups)
+        return ([], set())
+
+    def cacheNameserver(self, zone, ttl, task):
+        if not task.cancelled():
+            addresses, addressTtl = task.result()
+            self.delegationCache.addAddresses(zone, addresses, min(ttl, addressTtl))
+
+    async def resolveAddresses(self, name, depth):
+        # Returns (A record addresses of name, their TTL), from the answer cache when
+        # possible.
+        if depth > MAX_DEPTH:
+            return ([], 0)
+        key = (name, types['A'], qclass['IN'])
+        cached = self.answerCache.get(key)
+        if cached is not None:
+            records = sectionRecords(cached[0].answers, types['A'])
+            return ([record.address() for record in records], min([record.ttl for record in records], default=0) - cached[1])
+
+        message = await self.iterate(createQuery('A', name.rstrip('.')), depth)
+        if message is None:
+            return ([], 0)
+        self.cacheAnswer(key, message)
+        records = sectionRecords(message.answers, types['A'])
+        return ([record.address() for record in records], min([record.ttl for record in records], default=0))
+
+class ResolverProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.transport = None
+        self.tasks = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        # Every client query is resolved in its own task, so a slow zone only delays the
+        # clients asking for it.
+        if len(data) < 12:
+            return
+        task = asyncio.ensure_future(self.handleQuery(data, address))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handleQuery(self, clientQuery, clientAddress):
+        try:
+            response = await self.resolver.resolve(clientQuery, client=clientAddress[0])
+        except (struct.error, IndexError, ValueError):
+            response = formatError(clientQuery) # Malformed query, RFC 1035 Section 4.1.1.
+        self.transport.sendto(response, clientAddress) # Send it back to client for parsing.
+
+class ResolverTcpServer:
+    # DNS over TCP (RFC 7766) on the resolver port. A client keeps its connection open for as
+    # many queries as it likes and may send them without waiting for replies; each query is
+    # resolved in its own task and answered as soon as it is done, so replies come back in
+    # the order resolutions finish rather than the order queries arrived (Section 6.2.1.1).
+
+    def __init__(self, resolver, idleTimeout=TCP_IDLE_TIMEOUT, pipeline=TCP_PIPELINE, maxConnections=TCP_CONNECTIONS):
+        self.resolver = resolver
+        self.idleTimeout = idleTimeout
+        self.pipeline = pipeline
+        self.maxConnections = maxConnections
+        self.connections = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.queries = 0
+
+    async def handleConnection(self, reader, writer):
+        if self.connections >= self.maxConnections:
+            self.rejected += 1
+            writer.close()
+            return
+        self.connections += 1
+        self.accepted += 1
+        peer = writer.get_extra_info('peername')
+        client = peer[0] if peer is not None else None
+        # Once pipeline queries are outstanding, no more are read until one is answered, which
+        # pushes back on the client through TCP flow control.
+        slots = asyncio.Semaphore(self.pipeline)
+        tasks = set()
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    prefix = await asyncio.wait_for(reader.readexactly(2), self.idleTimeout)
+                except asyncio.TimeoutError:
+                    slots.release()
+                    if len(tasks) > 0:
+                        continue # Not idle while queries are outstanding.
+                    break
+                length = struct.unpack('!H', prefix)[0]
+                clientQuery = await asyncio.wait_for(reader.readexactly(length), self.idleTimeout)
+                if length < 12:
+                    slots.release()
+                    continue # Malformed query, drop it.
+                self.queries += 1
+                task = asyncio.ensure_future(self.handleQuery(clientQuery, writer, slots, client))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass # Closed by the client, or stalled in the middle of a message.
+        finally:
+            # A client may close its side after its last query and still read the replies.
+            if len(tasks) > 0:
+                await asyncio.wait(tasks)
+            self.connections -= 1
+            writer.close()
+
+    async def handleQuery(self, clientQuery, writer, slots, client):
+        try:
+            response = await self.resolver.resolve(clientQuery, udp=False, client=client)
+        except (struct.error, IndexError, ValueError):
+            response = formatError(clientQuery) # Malformed query, RFC 1035 Section 4.1.1.
+        finally:
+            slots.release()
+        if writer.is_closing():
+            return
+        # Messages over TCP are prefixed with their length (RFC 1035 Section 4.2.2).
+        writer.write(struct.pack('!H', len(response)) + response)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def stats(self):
+        return {'accepted': self.accepted, 'rejected': self.rejected, 'queries': self.queries}
+
+def serverSocket(serverPort, reusePort, sockType=socket.SOCK_DGRAM):
+    # With reusePort every worker process binds its own socket to the port, and the kernel
+    # balances client queries (and TCP connections) between them.
+    sock = socket.socket(socket.AF_INET, sockType)
+    if reusePort:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if sockType == socket.SOCK_STREAM:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    sock.bind(('localhost', serverPort))
+    return sock
 
-with open("named.root", 'r') as f:
+async def saveSnapshots(resolver, fileName, interval):
     while True:
-        line = f.readline()
-        if len(line) > 0 and line[0] != ';' and line[0] != '.':
-            data = line.split(' ')
-            data = [item for item in data if item != '' and item != ' ']
-            if data[2] != 'AAAA':
-                rootServers.append(data[3].replace('\n', ''))
-        if not line:
-            break
-while True:
-    timeOut = False
-    if clientQuery == None:
-        message, address = serverSocket.recvfrom(2048) # Recieve request from client
-        clientQuery = message
-        currServer =  rootServers[0] # Get first root server IP
-        clientAddress = address
-        dnsSocket.sendto(clientQuery, (currServer, 53)) # Else start sending to next server.
-
+        await asyncio.sleep(interval)
+        writeSnapshot(resolver, fileName)
+
+def writeSnapshot(resolver, fileName):
+    try:
+        saveSnapshot(fileName, resolver.answerCache, resolver.delegationCache)
+    except (OSError, struct.error, ValueError) as error:
+        print(f"Could not write snapshot {fileName}: {error}", file=sys.stderr)
+
+def openSnapshot(resolver, fileName):
+    # Starts from the snapshot a previous run left in fileName, if any.
+    try:
+        snapshot = loadSnapshot(fileName)
+    except (OSError, ValueError) as error:
+        print(f"Ignoring snapshot {fileName}: {error}", file=sys.stderr)
+        return
+    if snapshot is not None:
+        resolver.answerCache.snapshot = snapshot
+        restoreDelegations(snapshot, resolver.delegationCache)
+        print(f"Snapshot: {len(snapshot.index)} answers, {len(snapshot.delegations)} delegations", file=sys.stderr)
+
+async def runResolver(args, sharedCache=None, workerIndex=None):
+    # Serves the resolver configured by the command line arguments args. Workers started by
+    # the supervisor pass the shared cache and their index.
+    answerCache = AnswerCache(args.cache_entries, args.cache_bytes, sharedCache, args.serve_stale)
+    admission = AdmissionControl(args.max_active, args.max_queued, args.timeout)
+    resolver = Resolver(readRootHints(args.root_hints), args.timeout, answerCache, hedgeRatio=args.hedge_ratio,
+        upstreamPort=args.upstream_port, prefetch=not args.no_prefetch, ednsPayload=args.edns_payload, admission=admission)
+    snapshotFile = args.snapshot
+    if snapshotFile is not None and workerIndex is not None:
+        snapshotFile += f".{workerIndex}" # Every worker has a cache of its own to save.
+    if snapshotFile is not None:
+        openSnapshot(resolver, snapshotFile)
+    await resolver.open()
+    resolver.startPriming()
+
+    loop = asyncio.get_running_loop()
+    serverTransport, serverProtocol = await loop.create_datagram_endpoint(
+        lambda: ResolverProtocol(resolver), sock=serverSocket(args.port, workerIndex is not None))
+    tcpServer = ResolverTcpServer(resolver, args.tcp_idle_timeout, args.tcp_pipeline, args.tcp_connections)
+    tcpListener = await asyncio.start_server(tcpServer.handleConnection,
+        sock=serverSocket(args.port, workerIndex is not None, socket.SOCK_STREAM))
+    stopped = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopped.set)
+    if snapshotFile is not None:
+        snapshotTask = asyncio.ensure_future(saveSnapshots(resolver, snapshotFile, args.snapshot_interval))
+    metricsServer = None
+    if args.metrics_port is not None:
+        # Every worker serves its own metrics, on the port after the previous worker's.
+        metricsPort = args.metrics_port + (workerIndex if workerIndex is not None else 0)
+        metricsServer = await serveMetrics(metricsPort, lambda: renderMetrics(resolver, tcpServer))
+    try:
+        await stopped.wait() # Serve until interrupted or terminated.
+    finally:
+        serverTransport.close()
+        tcpListener.close()
+        if metricsServer is not None:
+            metricsServer.close()
+        resolver.close()
+        if snapshotFile is not None:
+            snapshotTask.cancel()
+            writeSnapshot(resolver, snapshotFile)
+        print(f"Answer cache: {resolver.answerCache.stats()}", file=sys.stderr)
+        print(f"Delegation cache: {resolver.delegationCache.stats()}", file=sys.stderr)
+        print(f"Coalesced queries: {resolver.coalesced}", file=sys.stderr)
+        print(f"Admission: {resolver.admission.stats()}", file=sys.stderr)
+        print(f"Prefetches: {resolver.prefetches}, stale answers: {resolver.staleAnswers}", file=sys.stderr)
+        print(f"CNAME lookups: {resolver.cnameLookups}, failed chains: {resolver.cnameFailures}", file=sys.stderr)
+        print(f"Root primes: {resolver.primes}, root servers: {len(resolver.rootServers)}", file=sys.stderr)
+        print(f"Upstream TCP queries: {resolver.upstream.tcpQueries + resolver.glueUpstream.tcpQueries}, "
+            f"servers without EDNS0: {len(resolver.upstream.noEdns | resolver.glueUpstream.noEdns)}, "
+            f"truncated answers: {resolver.truncatedAnswers}, "
+            f"source port rotations: {resolver.upstream.rotations + resolver.glueUpstream.rotations}", file=sys.stderr)
+        print(f"TCP clients: {tcpServer.stats()}", file=sys.stderr)
+        print(f"Upstream TCP connections: {resolver.tcpPool.stats()}", file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python3 Resolver.py [resolver_port] [timeout=5]")
+    parser.add_argument('port', type=int)
+    # Note: Confirmed that client and resolver timeouts dont have to match:
+    # https://edstem.org/au/courses/11968/discussion/1467216
+    # Implementation based on this assumption as not specified otherwise in specification:
+    parser.add_argument('timeout', type=float, nargs='?', default=5)
+    parser.add_argument('--cache-entries', type=int, default=MAX_ENTRIES, help="maximum number of cached answers")
+    parser.add_argument('--cache-bytes', type=int, default=MAX_BYTES, help="maximum memory charged to cached answers")
+    parser.add_argument('--hedge-ratio', type=float, default=HEDGE_RATIO, help="hedged queries allowed per primary query, 0 disables hedging")
+    parser.add_argument('--workers', type=int, default=1, help="number of resolver processes sharing the port")
+    parser.add_argument('--shared-cache-mb', type=int, default=SHARED_CACHE_MB, help="size of the answer cache shared by workers")
+    parser.add_argument('--root-hints', default="named.root", help="root hints file, e.g. mock.root written by mockHierarchy.py")
+    parser.add_argument('--upstream-port', type=int, default=DNS_PORT, help="port root and authoritative servers are queried on")
+    parser.add_argument('--no-prefetch', action='store_true', help="do not refresh popular entries before they expire")
+    parser.add_argument('--serve-stale', type=int, default=MAX_STALE, help="seconds past expiry an answer may be served stale, 0 disables")
+    parser.add_argument('--snapshot', default=None, help="file the caches are saved to and restored from across restarts")
+    parser.add_argument('--edns-payload', type=int, default=EDNS_PAYLOAD, help="UDP payload size advertised with EDNS0, 0 disables EDNS0")
+    parser.add_argument('--tcp-idle-timeout', type=float, default=TCP_IDLE_TIMEOUT, help="seconds an idle TCP connection is kept open")
+    parser.add_argument('--tcp-pipeline', type=int, default=TCP_PIPELINE, help="queries resolved at once per TCP connection")
+    parser.add_argument('--tcp-connections', type=int, default=TCP_CONNECTIONS, help="maximum number of TCP clients connected at once")
+    parser.add_argument('--max-active', type=int, default=MAX_ACTIVE, help="resolutions run at once, further queries are queued")
+    parser.add_argument('--max-queued', type=int, default=MAX_QUEUED, help="queries waiting for a resolution, further ones get SERVFAIL")
+    parser.add_argument('--metrics-port', type=int, default=None, help="local port serving metrics in the Prometheus text format")
+    parser.add_argument('--snapshot-interval', type=float, default=SNAPSHOT_INTERVAL, help="seconds between snapshots")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # The shared cache must exist before the workers are forked so they all map it.
+        sharedCache = SharedAnswerStore(args.shared_cache_mb)
+        runSupervisor(args.workers, lambda index: asyncio.run(runResolver(args, sharedCache, index)))
     else:
         try:
-            message, address = dnsSocket.recvfrom(2048) # Recieve request from client
-            isAnswer = checkIfAnswer(message)
-        except socket.timeout:
-            isAnswer = False
-            timeOut = True
-        # Check if an answer was recieved from server.
-        if isAnswer:
-
-            data = parseResponse(message, False)
-            serverSocket.sendto(message, clientAddress) # Send it back to client for parsing.
-            encounteredAnswers = []
-            clientAddress = None
-            clientQuery = None
-        else:
-            if timeOut:
-                if currServer == rootServers[-1]:
-                    message = "timeout".encode()
-                    serverSocket.sendto(message, clientAddress) # Send it back to client for parsing as all roots exhausted.
-                    encounteredAnswers = []
-                    clientAddress = None
-                    clientQuery = None
-                elif currServer in rootServers and currServer != rootServers[-1]:
-                    currServer = rootServers[rootServers.index(currServer) + 1]
-                    dnsSocket.sendto(clientQuery, (currServer, 53)) # Else start sending to next server.
-                elif len(prevData['additionals']) > 0:
-                    currServer = prevData['additionals'][0]
-                    dnsSocket.sendto(clientQuery, (currServer, 53)) # Else start sending to next server.
-                    prevData['additionals'].pop(0) # Remove exhausted ip
-                else:
-                    message = "timeout".encode()
-                    serverSocket.sendto(message, clientAddress) # Send it back to client for parsing as all roots exhausted.
-                    encounteredAnswers = []
-                    clientAddress = None
-                    clientQuery = None
-            else:
-                data = parseResponse(message, False)
-                # If currServer doesnt have IP address information, get it ourselves
-                if data['additionals'] == [] and len(data['ns']) > 0:
-                    queryToSend = createQuery('A', data['ns'][0][:-1])
-                    currAnswer = resolverIntermediaryQuery(dnsSocket, rootServers, queryToSend)
-
-                    if currAnswer != {} and currServer in currAnswer['answers']:
-                        currAnswer['answers'].remove(currServer) # Avoid self loop
-                    if currAnswer != {}:
-                        for answerCurr in currAnswer['answers']:
-                            if answerCurr in encounteredAnswers:
-                                currAnswer['answers'].remove(answerCurr) # Avoid infinite loop of contacting same servers, also avoid back and forth reference.
-                                # Where server A points to Server B and Server B points to Server A
-                    if currAnswer != {} and len(currAnswer['answers']) > 0 and currAnswer['answers'][0] not in encounteredAnswers:
-
-                        currServer = currAnswer['answers'][0]
-
-                        encounteredAnswers.append(currServer)
-                        dnsSocket.sendto(clientQuery, (currServer, 53)) # Else start sending to next server.
-
-                # If some issue occurs with the server, exhaust all ips
-                elif data['rcode'] == 'SERVFAIL' or data['rcode'] == 'REFUSED' or data['additionals'] == []:
-                    if currServer == rootServers[-1]:
-                        serverSocket.sendto(message, clientAddress) # Send it back to client for parsing as all roots exhausted.
-                        clientAddress = None
-                        clientQuery = None
-                        encounteredAnswers = []
-                    elif currServer in rootServers and currServer != rootServers[-1]:
-                        currServer = rootServers[rootServers.index(currServer) + 1]
-                        dnsSocket.sendto(clientQuery, (currServer, 53)) # Else start sending to next server.
-                    elif len(prevData['additionals']) > 0:
-                        currServer = prevData['additionals'][0]
-                        dnsSocket.sendto(clientQuery, (currServer, 53)) # Else start sending to next server.
-                        prevData['additionals'].pop(0) # Remove exhausted ip
-                    else:
-                        serverSocket.sendto(message, clientAddress) # Send it back to client for parsing as all roots exhausted.
-                        encounteredAnswers = []
-                        clientAddress = None
-                        clientQuery = None
-                elif data['rcode'] == 'NXDOMAIN' or data['rcode'] == 'FORMERR':
-                    serverSocket.sendto(message, clientAddress) # Send it back to client for parsing.
-                    encounteredAnswers = []
-                    clientAddress = None
-                    clientQuery = None # End query resolving processs.
-                else:
-                    currServer = data['additionals'][0]
-                    dnsSocket.sendto(clientQuery, (currServer, 53)) # Else start sending to next server.
-                    data['additionals'].pop(0) # Remove exhausted ip
-                    if data['additionals'] != []:
-                        prevData = copy.deepcopy(data)
-                     # Only save data from last iterative query once a valid response was given.
-
-
-
-
-
-
-
+            asyncio.run(runResolver(args))
+        except KeyboardInterrupt:
+            pass
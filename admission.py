@@ -0,0 +1,134 @@
+import asyncio
+from collections import OrderedDict, deque
+
+# Admission control for client queries that miss the cache. At most MAX_ACTIVE resolutions
+# run at once; further queries wait in a queue bounded at MAX_QUEUED, and are answered right
+# away with an error when it is full rather than left to time out.
+#
+# The queue is fair between clients: every client address has a queue of its own, and free
+# slots go to the clients in turn, so one client flooding the resolver only delays its own
+# queries. When the queue is full, a query from a client with fewer queries waiting than the
+# longest queue pushes out the newest query of that queue.
+#
+# Background work (prefetch) is only admitted while less than LOW_PRIORITY_SHARE of the
+# slots are busy and nobody is waiting.
+
+MAX_ACTIVE = 500
+MAX_QUEUED = 2000
+LOW_PRIORITY_SHARE = 0.5
+
+class AdmissionControl:
+
+    def __init__(self, maxActive=MAX_ACTIVE, maxQueued=MAX_QUEUED, maxWait=None, lowPriorityShare=LOW_PRIORITY_SHARE):
+        self.maxActive = maxActive
+        self.maxQueued = maxQueued
+        # Queries that waited longer than maxWait seconds, by when their clients have given
+        # up, are not started: acquire returns False and they are answered like shed ones.
+        self.maxWait = maxWait
+        self.lowPriorityLimit = maxActive * lowPriorityShare
+        self.active = 0
+        # Client address -> deque of (time queued, future granted a slot), in the order
+        # clients get their turn.
+        self.queues = OrderedDict()
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.expired = 0
+        self.lowPriorityShed = 0
+        self.peakQueued = 0
+
+    def underPressure(self):
+        return self.queued > 0 or self.active >= self.lowPriorityLimit
+
+    def tryAcquireLowPriority(self):
+        # Takes a slot for background work if there is room for it, never queueing.
+        if self.underPressure():
+            self.lowPriorityShed += 1
+            return False
+        self.active += 1
+        return True
+
+    async def acquire(self, client):
+        # Waits for a slot for a query from client. Returns False if the query was shed, and
+        # the caller should answer it with an error; otherwise the caller calls release()
+        # once the resolution is done.
+        if self.active < self.maxActive and self.queued == 0:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if self.queued >= self.maxQueued and not self.pushOut(client):
+            self.shed += 1
+            return False
+
+        loop = asyncio.get_running_loop()
+        entry = (loop.time(), loop.create_future())
+        if client not in self.queues:
+            self.queues[client] = deque()
+        self.queues[client].append(entry)
+        self.queued += 1
+        self.peakQueued = max(self.peakQueued, self.queued)
+        try:
+            granted = await entry[1]
+        except asyncio.CancelledError:
+            if entry[1].done() and not entry[1].cancelled() and entry[1].result():
+                self.release()
+            else:
+                self.remove(client, entry)
+            raise
+        if granted:
+            self.admitted += 1
+        return granted
+
+    def pushOut(self, client):
+        # Makes room in a full queue by shedding the newest query of the longest queue, if
+        # that is longer than the queue of client.
+        if len(self.queues) == 0:
+            return False # No queue at all with --max-queued 0.
+        longest = max(self.queues, key=lambda other: len(self.queues[other]))
+        if longest == client or len(self.queues[longest]) <= len(self.queues.get(client, ())):
+            return False
+        entry = self.queues[longest].pop()
+        if len(self.queues[longest]) == 0:
+            del self.queues[longest]
+        self.queued -= 1
+        self.shed += 1
+        entry[1].set_result(False)
+        return True
+
+    def remove(self, client, entry):
+        queue = self.queues.get(client)
+        if queue is not None and entry in queue:
+            queue.remove(entry)
+            self.queued -= 1
+            if len(queue) == 0:
+                del self.queues[client]
+
+    def release(self):
+        # Frees a slot and hands it to the next client in turn.
+        self.active -= 1
+        now = asyncio.get_running_loop().time()
+        while self.active < self.maxActive and self.queued > 0:
+            client, queue = self.queues.popitem(last=False)
+            queued, future = queue.popleft()
+            self.queued -= 1
+            if len(queue) > 0:
+                self.queues[client] = queue # To the back of the line.
+            if future.done():
+                continue
+            if self.maxWait is not None and now - queued > self.maxWait:
+                self.expired += 1
+                future.set_result(False)
+                continue
+            self.active += 1
+            future.set_result(True)
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': self.queued,
+            'peakQueued': self.peakQueued,
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'expired': self.expired,
+            'lowPriorityShed': self.lowPriorityShed,
+        }
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import struct
+import sys
+import time
+from helpers import questionBytes, parseResponse, ptrName, types, invertedTypes, invertedClasses
+from encoder import createQuery as encodeQuery, EDNS_PAYLOAD
+
+# Batch mode of Client.py. Questions are read from a file or stdin, one "name [type]" per line
+# (dlist4000.txt works as is), and sent to the resolver over a single UDP socket with up to
+# WINDOW of them outstanding. Replies are matched to their query by transaction ID and
+# question, and results are written as they arrive, as tab separated lines or JSON lines.
+# Queries carry an EDNS0 OPT record, so answers of up to EDNS_PAYLOAD bytes are not truncated.
+
+WINDOW = 100
+TIMEOUT = 5.0
+
+# At most this many queries can be outstanding, as each needs a distinct transaction ID.
+MAX_WINDOW = 60000
+
+def parseQuestion(line, defaultType):
+    # Returns (name, type) for a line of input, or None for blank and comment lines.
+    fields = line.split()
+    if len(fields) == 0 or fields[0][0] in '#;':
+        return None
+    queryType = fields[1].upper() if len(fields) > 1 else defaultType
+    if queryType not in types:
+        raise ValueError(f"unsupported query type {queryType}")
+    return (fields[0], queryType)
+
+class BatchProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        # Transaction ID -> (question section, future of the reply) of every outstanding query.
+        self.pending = {}
+        self.unmatched = 0
+
+    def datagram_received(self, data, address):
+        if len(data) < 12:
+            self.unmatched += 1 # Resolver gave up, its reply carries no ID to match.
+            return
+        entry = self.pending.get(struct.unpack_from('!H', data, 0)[0])
+        try:
+            matches = entry is not None and questionBytes(data) == entry[0]
+        except (ValueError, IndexError):
+            matches = False
+        if not matches or entry[1].done():
+            self.unmatched += 1
+            return
+        entry[1].set_result(data)
+
+    def error_received(self, exc):
+        pass # ICMP errors show up as timeouts of the affected queries.
+
+class BatchClient:
+
+    def __init__(self, resolverAddress, window=WINDOW, timeout=TIMEOUT):
+        self.resolverAddress = resolverAddress
+        self.window = min(max(window, 1), MAX_WINDOW)
+        self.timeout = timeout
+        self.transport = None
+        self.protocol = None
+        self.sent = 0
+        self.answered = 0
+        self.timeouts = 0
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(
+            BatchProtocol, remote_addr=self.resolverAddress)
+
+    def close(self):
+        self.transport.close()
+
+    async def query(self, name, queryType):
+        # Sends one question and returns (reply or None on timeout, seconds taken).
+        qtype = types[queryType]
+        queryName = ptrName(name) if queryType == 'PTR' else name
+        query = encodeQuery(qtype, queryName, 1, 0, EDNS_PAYLOAD)
+        while struct.unpack_from('!H', query, 0)[0] in self.protocol.pending:
+            query = encodeQuery(qtype, queryName, 1, 0, EDNS_PAYLOAD) # ID in use by an outstanding query.
+        queryId = struct.unpack_from('!H', query, 0)[0]
+
+        loop = asyncio.get_running_loop()
+        reply = loop.create_future()
+        self.protocol.pending[queryId] = (questionBytes(query), reply)
+        start = time.perf_counter()
+        try:
+            self.transport.sendto(query)
+            self.sent += 1
+            response = await asyncio.wait_for(reply, self.timeout)
+            self.answered += 1
+        except asyncio.TimeoutError:
+            response = None
+            self.timeouts += 1
+        finally:
+            del self.protocol.pending[queryId]
+        return (response, time.perf_counter() - start)
+
+    async def run(self, questions, report, rate=None):
+        # Queries every (name, type) of the iterable questions, keeping up to window queries
+        # outstanding, and calls report(name, type, reply, seconds) as each one completes.
+        # With a rate, queries are also paced to that many per second.
+        slots = asyncio.Semaphore(self.window)
+        tasks = set()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        count = 0
+
+        async def queryOne(name, queryType):
+            try:
+                response, elapsed = await self.query(name, queryType)
+                report(name, queryType, response, elapsed)
+            finally:
+                slots.release()
+
+        for name, queryType in questions:
+            if rate is not None:
+                delay = start + count / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                count += 1
+            await slots.acquire()
+            task = asyncio.ensure_future(queryOne(name, queryType))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if len(tasks) > 0:
+            await asyncio.gather(*tasks)
+
+def resultRecord(name, queryType, response, elapsed):
+    # Result of one query as a dictionary, the JSON output form.
+    result = {"name": name, "type": queryType, "time": round(elapsed, 4)}
+    if response is None:
+        result["status"] = "TIMEOUT"
+        return result
+    try:
+        data = parseResponse(response, True)
+    except ValueError:
+        result["status"] = "MALFORMED"
+        return result
+    result["status"] = data['rcode']
+    result["answers"] = []
+    for count in range(0, data['anscount']):
+        extras = data['answersExtras'][count]
+        result["answers"].append({
+            "name": extras["ansName"],
+            "ttl": extras["ansTTL"],
+            "class": invertedClasses.get(extras["ansClass"], extras["ansClass"]),
+            "type": invertedTypes.get(extras["ansType"], extras["ansType"]),
+            "data": data['answers'][count],
+        })
+    return result
+
+def formatLine(result):
+    answers = ','.join([str(answer["data"]) for answer in result.get("answers", [])])
+    return f"{result['name']}\t{result['type']}\t{result['status']}\t{result['time']}\t{answers}"
+
+def readQuestions(source, defaultType):
+    for line in source:
+        try:
+            question = parseQuestion(line, defaultType)
+        except ValueError as error:
+            print(f"Skipping {line.strip()}: {error}", file=sys.stderr)
+            continue
+        if question is not None:
+            yield question
+
+async def runBatch(resolverAddress, source, defaultType, window, timeout, asJson):
+    client = BatchClient(resolverAddress, window, timeout)
+    await client.open()
+
+    def report(name, queryType, response, elapsed):
+        result = resultRecord(name, queryType, response, elapsed)
+        print(json.dumps(result) if asJson else formatLine(result))
+
+    start = time.perf_counter()
+    try:
+        await client.run(readQuestions(source, defaultType), report)
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - start
+    print(f"Sent: {client.sent}, answered: {client.answered}, timeouts: {client.timeouts}, "
+        f"time: {round(elapsed, 4)} sec, {round(client.sent / elapsed, 1) if elapsed > 0 else 0} queries/sec", file=sys.stderr)
+
+def batchMain(argv):
+    parser = argparse.ArgumentParser(prog="Client.py",
+        usage="python3 Client.py [resolver_ip] [resolver_port] --batch [file|-] [--type=A] [--window=100] [--timeout=5] [--json]")
+    parser.add_argument('resolverIP')
+    parser.add_argument('resolverPort', type=int)
+    parser.add_argument('--batch', required=True, help="file of 'name [type]' lines, - for stdin")
+    parser.add_argument('--type', default='A', help="type of names listed without one")
+    parser.add_argument('--window', type=int, default=WINDOW, help="maximum number of outstanding queries")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT)
+    parser.add_argument('--json', action='store_true', help="write one JSON object per result")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.batch == '-' else open(args.batch, 'r')
+    try:
+        asyncio.run(runBatch((args.resolverIP, args.resolverPort), source, args.type.upper(), args.window, args.timeout, args.json))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if source is not sys.stdin:
+            source.close()
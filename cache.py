@@ -0,0 +1,242 @@
+import time
+from collections import OrderedDict
+from message import OPT_TYPE
+
+# Default bounds for the answer cache. An entry is charged the length of its records' buffers
+# plus a fixed overhead for the key, the entry and each record object.
+MAX_ENTRIES = 10000
+MAX_BYTES = 16 * 1024 * 1024
+ENTRY_OVERHEAD = 200
+RECORD_OVERHEAD = 100
+
+# TTLs are clamped to this value, as allowed by RFC 2181 Section 8.
+MAX_TTL = 86400
+
+# Negative answers are cached for at most this long, as recommended by RFC 2308 Section 5.
+MAX_NEGATIVE_TTL = 10800
+
+# Expired entries are kept this much longer to be served stale when a name can not be
+# resolved, within the one to three days recommended by RFC 8767 Section 5.
+MAX_STALE = 86400
+
+# qtype used in the key of an NXDOMAIN entry. An NXDOMAIN says the name does not exist at all,
+# so it answers every type of question for that name (RFC 2308 Section 5).
+ANY_TYPE = None
+
+class CacheEntry:
+    # A cached answer, kept as detached records so answers can be encoded for any client.
+    __slots__ = ('flags', 'answers', 'authority', 'additional', 'stored', 'expires', 'negative', 'size', 'hits', 'failed')
+
+    def __init__(self, message, stored, expires, negative):
+        self.flags = message.flags
+        self.answers = [record.detach() for record in message.answers]
+        self.authority = [record.detach() for record in message.authority]
+        # The OPT pseudo-record (RFC 6891) belongs to a single hop and is never cached.
+        self.additional = [record.detach() for record in message.additional if record.rtype != OPT_TYPE]
+        self.stored = stored
+        self.expires = expires
+        self.negative = negative
+        # Cache hits since stored, and when a refresh of the expired entry last failed.
+        self.hits = 0
+        self.failed = 0.0
+        self.size = ENTRY_OVERHEAD
+        for record in self.answers + self.authority + self.additional:
+            self.size += len(record.buffer) + RECORD_OVERHEAD
+
+class AnswerCache:
+
+    def __init__(self, maxEntries=MAX_ENTRIES, maxBytes=MAX_BYTES, shared=None, maxStale=MAX_STALE):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.maxStale = maxStale
+        # Optional store shared with other worker processes (sharedCache.SharedAnswerStore).
+        # It is consulted on a miss and every new entry is written through to it.
+        self.shared = shared
+        # Optional snapshot written by a previous run (snapshot.Snapshot), whose entries are
+        # taken over on their first lookup.
+        self.snapshot = None
+        # (qname, qtype, qclass) -> CacheEntry, least recently used first.
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.negativeEntries = 0
+        self.negativeHits = 0
+
+    def get(self, key):
+        now = time.time()
+        entry = self.lookup(key, now)
+        if entry is None:
+            entry = self.lookup((key[0], ANY_TYPE, key[2]), now)
+        if entry is None and self.shared is not None:
+            entry = self.lookupShared(key, now)
+            if entry is None:
+                entry = self.lookupShared((key[0], ANY_TYPE, key[2]), now)
+        if entry is None and self.snapshot is not None:
+            entry = self.lookupSnapshot(key, now)
+            if entry is None:
+                entry = self.lookupSnapshot((key[0], ANY_TYPE, key[2]), now)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.negative:
+            self.negativeHits += 1
+        else:
+            self.hits += 1
+        entry.hits += 1
+        return (entry, int(now - entry.stored))
+
+    def getStale(self, key):
+        # Returns (entry, age) of an expired entry still within maxStale of its expiry, for
+        # serving stale (RFC 8767), or None.
+        now = time.time()
+        for staleKey in (key, (key[0], ANY_TYPE, key[2])):
+            entry = self.entries.get(staleKey)
+            if entry is not None and entry.expires <= now < entry.expires + self.maxStale:
+                return (entry, int(now - entry.stored))
+        return None
+
+    def lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            if entry.expires + self.maxStale <= now:
+                self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def lookupShared(self, key, now):
+        entry = self.shared.load(key, now)
+        if entry is not None:
+            self.insert(key, entry)
+        return entry
+
+    def put(self, key, message, ttl):
+        self.store(key, message, min(ttl, MAX_TTL), False)
+
+    def putNegative(self, key, message, ttl):
+        # Caches an NXDOMAIN (with key's qtype set to ANY_TYPE) or NODATA response.
+        self.store(key, message, min(ttl, MAX_NEGATIVE_TTL), True)
+
+    def lookupSnapshot(self, key, now):
+        # Expired entries still within maxStale are taken over too, for getStale.
+        entry = self.snapshot.load(key)
+        if entry is None or entry.expires + self.maxStale <= now:
+            return None
+        self.insert(key, entry)
+        return entry if entry.expires > now else None
+
+    def store(self, key, message, ttl, negative):
+        if ttl <= 0:
+            return
+        now = time.time()
+        entry = CacheEntry(message, now, now + ttl, negative)
+        self.insert(key, entry)
+        if self.shared is not None:
+            self.shared.save(key, entry, now)
+
+    def insert(self, key, entry):
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = entry
+        self.size += entry.size
+        if entry.negative:
+            self.negativeEntries += 1
+
+        # Evict least recently used entries until both bounds hold again.
+        while len(self.entries) > self.maxEntries or self.size > self.maxBytes:
+            oldestKey = next(iter(self.entries))
+            self.remove(oldestKey)
+            self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+        if entry.negative:
+            self.negativeEntries -= 1
+
+    def stats(self):
+        stats = {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "negativeEntries": self.negativeEntries,
+            "negativeHits": self.negativeHits,
+        }
+        if self.shared is not None:
+            stats.update(self.shared.stats())
+        return stats
+
+def isSubdomain(name, zone):
+    # True if name is zone itself or lies below it. Names are lowercase and end in '.'.
+    return zone == '.' or name == zone or name.endswith('.' + zone)
+
+class Delegation:
+    __slots__ = ('nsNames', 'addresses', 'expires')
+
+    def __init__(self, nsNames, addresses, expires):
+        self.nsNames = nsNames
+        self.addresses = addresses
+        self.expires = expires
+
+class DelegationCache:
+
+    def __init__(self, maxEntries=MAX_ENTRIES):
+        self.maxEntries = maxEntries
+        # zone -> Delegation, least recently used first. The root zone is '.', every other
+        # zone ends in '.'.
+        self.zones = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, zone, nsNames, addresses, ttl):
+        ttl = min(ttl, MAX_TTL)
+        if ttl <= 0:
+            return
+        self.zones.pop(zone, None)
+        self.zones[zone] = Delegation(nsNames, list(addresses), time.time() + ttl)
+        while len(self.zones) > self.maxEntries:
+            self.zones.popitem(last=False)
+            self.evictions += 1
+
+    def addAddresses(self, zone, addresses, ttl):
+        # Records the addresses found for a delegation that came without glue.
+        entry = self.zones.get(zone)
+        if entry is None:
+            return
+        entry.expires = min(entry.expires, time.time() + min(ttl, MAX_TTL))
+        entry.addresses += [address for address in addresses if address not in entry.addresses]
+
+    def findClosest(self, qname):
+        # Returns (zone, addresses) of the deepest cached zone cut at or above qname that
+        # has usable addresses, or None if resolution has to start at the root.
+        now = time.time()
+        labels = qname.rstrip('.').split('.')
+        for count in range(0, len(labels)):
+            zone = '.'.join(labels[count:]) + '.'
+            entry = self.zones.get(zone)
+            if entry is None:
+                continue
+            if entry.expires <= now:
+                del self.zones[zone]
+                continue
+            if len(entry.addresses) > 0:
+                self.zones.move_to_end(zone)
+                self.hits += 1
+                return (zone, list(entry.addresses))
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {
+            "zones": len(self.zones),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,221 @@
+import asyncio
+import struct
+from helpers import questionBytes
+from encoder import randomId
+
+# Persistent TCP connections to authoritative servers (RFC 7766 Section 6.2.1), so a reply
+# truncated over UDP costs a round trip on an open connection rather than a new handshake
+# every time. Connections are kept per server address. Queries are pipelined: several can be
+# outstanding on one connection, and replies are matched to them by transaction ID and
+# question in whatever order they come back. Another connection to a server is only opened
+# once every open one carries PIPELINE queries, up to MAX_CONNECTIONS per server.
+#
+# A connection is dropped when the server closes it (also checked before it is reused), when
+# a query on it times out without any other reply having arrived since it was sent (the
+# server does not pipeline, or the path is dead), and when it has been idle for IDLE_TIMEOUT
+# seconds, checked every CHECK_INTERVAL.
+
+MAX_CONNECTIONS = 2
+PIPELINE = 32
+IDLE_TIMEOUT = 20.0
+CHECK_INTERVAL = 5.0
+CONNECT_TIMEOUT = 5.0
+
+class UpstreamConnection:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # (transaction ID, question section) -> future of the reply, for every outstanding
+        # query.
+        self.pending = {}
+        self.closed = False
+        self.queries = 0
+        loop = asyncio.get_running_loop()
+        self.lastUsed = loop.time()
+        self.lastReply = loop.time()
+        self.readTask = asyncio.ensure_future(self.readReplies())
+
+    async def readReplies(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                # Messages over TCP are prefixed with their length (RFC 1035 Section 4.2.2).
+                length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+                data = await self.reader.readexactly(length)
+                self.lastReply = loop.time()
+                if len(data) < 12:
+                    continue
+                future = self.pending.get((struct.unpack_from('!H', data, 0)[0], questionBytes(data)))
+                if future is not None and not future.done():
+                    future.set_result(data)
+        except (asyncio.IncompleteReadError, OSError, ValueError, IndexError):
+            pass # Closed by the server, broken, or sending garbage.
+        finally:
+            self.close()
+
+    def stale(self):
+        # Whether the server has already closed the connection, or its transport is shutting
+        # down, without the reader having noticed yet. Cheap enough to check before every reuse.
+        return self.reader.at_eof() or self.writer.transport.is_closing()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.close()
+        self.readTask.cancel()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_result(None)
+
+    async def query(self, packet, question, timeout):
+        # Sends packet under a transaction ID not outstanding on this connection. Returns the
+        # reply, or None if the connection closed first. Raises asyncio.TimeoutError if no
+        # reply arrives within timeout seconds.
+        while True:
+            queryId = randomId()
+            key = (queryId, question)
+            if key not in self.pending:
+                break
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[key] = future
+        self.queries += 1
+        sent = loop.time()
+        try:
+            self.writer.write(struct.pack('!HH', len(packet), queryId) + packet[2:])
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if self.lastReply < sent:
+                self.close() # Nothing came back at all while waiting, don't reuse it.
+            raise
+        finally:
+            self.pending.pop(key, None)
+            self.lastUsed = loop.time()
+
+class ConnectionPool:
+
+    def __init__(self, port, selector=None, maxConnections=MAX_CONNECTIONS, pipeline=PIPELINE, idleTimeout=IDLE_TIMEOUT):
+        self.port = port
+        # Outcomes of TCP queries feed the same per server RTT and failure tracking as UDP
+        # ones, and servers it holds down are not connected to.
+        self.selector = selector
+        self.maxConnections = maxConnections
+        self.pipeline = pipeline
+        self.idleTimeout = idleTimeout
+        # Server address -> open connections, and -> task opening one. Only one connection
+        # per server is opened at a time, queries arriving meanwhile wait for it.
+        self.connections = {}
+        self.opening = {}
+        self.checkTask = None
+        self.opened = 0
+        self.reused = 0
+        self.evicted = 0
+        self.connectFailures = 0
+
+    def start(self):
+        self.checkTask = asyncio.ensure_future(self.checkConnections())
+
+    def close(self):
+        if self.checkTask is not None:
+            self.checkTask.cancel()
+        for connections in self.connections.values():
+            for connection in connections:
+                connection.close()
+        self.connections = {}
+
+    async def checkConnections(self):
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            self.evictIdle(asyncio.get_running_loop().time())
+
+    def evictIdle(self, now):
+        for server in list(self.connections):
+            connections = []
+            for connection in self.connections[server]:
+                if not connection.closed and len(connection.pending) == 0 and now - connection.lastUsed > self.idleTimeout:
+                    connection.close()
+                    self.evicted += 1
+                if not connection.closed:
+                    connections.append(connection)
+            if len(connections) > 0:
+                self.connections[server] = connections
+            else:
+                del self.connections[server]
+
+    async def acquire(self, server):
+        # Returns a connection to server with room for another query, or None if none could
+        # be opened.
+        connections = []
+        for connection in self.connections.get(server, []):
+            if not connection.closed and connection.stale():
+                connection.close()
+                self.evicted += 1
+            if not connection.closed:
+                connections.append(connection)
+        self.connections[server] = connections
+        best = min(connections, key=lambda connection: len(connection.pending), default=None)
+        if best is not None and (len(best.pending) < self.pipeline or len(connections) >= self.maxConnections):
+            self.reused += 1
+            return best
+        if best is None and self.selector is not None and self.selector.isHeldDown(server):
+            return None
+
+        opening = self.opening.get(server)
+        if opening is None:
+            opening = asyncio.ensure_future(self.connect(server))
+            self.opening[server] = opening
+            opening.add_done_callback(lambda task: self.opening.pop(server, None))
+        return await asyncio.shield(opening)
+
+    async def connect(self, server):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(server, self.port), CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            self.connectFailures += 1
+            if self.selector is not None:
+                self.selector.recordFailure(server)
+            return None
+        connection = UpstreamConnection(reader, writer)
+        self.connections.setdefault(server, []).append(connection)
+        self.opened += 1
+        return connection
+
+    async def query(self, server, packet, timeout):
+        # Sends packet, a query without its length prefix, to server over a pooled
+        # connection. Returns the reply, or None on failure or after timeout seconds. A
+        # reused connection the server had already closed is retried once on a new one.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        question = questionBytes(packet)
+        for attempt in range(0, 2):
+            try:
+                connection = await asyncio.wait_for(self.acquire(server), deadline - loop.time())
+                if connection is None:
+                    return None
+                reused = connection.queries > 0
+                sent = loop.time()
+                response = await connection.query(packet, question, deadline - sent)
+            except asyncio.TimeoutError:
+                if self.selector is not None:
+                    self.selector.recordTimeout(server)
+                return None
+            if response is not None:
+                if self.selector is not None:
+                    self.selector.recordRtt(server, loop.time() - sent)
+                return response
+            if not reused:
+                break
+        if self.selector is not None:
+            self.selector.recordFailure(server)
+        return None
+
+    def stats(self):
+        return {
+            'connections': sum([len(connections) for connections in self.connections.values()]),
+            'opened': self.opened,
+            'reused': self.reused,
+            'evicted': self.evicted,
+            'connectFailures': self.connectFailures,
+        }
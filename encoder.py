@@ -0,0 +1,192 @@
+import os
+import struct
+from array import array
+from message import NAME_RDATA, OPT_TYPE, readName
+
+# Wire format encoder shared by Client.py and Resolver.py. Messages are written into a
+# preallocated buffer that is reused for every message, names are built from cached label
+# sequences, and names repeated inside a message are compressed (RFC 1035 Section 4.1.4).
+
+HEADER = struct.Struct('!HHHHHH')
+QUESTION = struct.Struct('!HH')
+RECORD = struct.Struct('!HHLH')
+
+# The header contains the following fields:
+
+#                                 1  1  1  1  1  1
+#   0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5
+# +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+# |                      ID                       |
+# +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+# |QR|   Opcode  |AA|TC|RD|RA|   Z    |   RCODE   |
+# +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+# |                    QDCOUNT                    |
+# +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+# |                    ANCOUNT                    |
+# +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+# |                    NSCOUNT                    |
+# +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+# |                    ARCOUNT                    |
+# +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+QR = 1 << 15
+AA = 1 << 10
+TC = 1 << 9
+RD = 1 << 8
+RA = 1 << 7
+
+# UDP payload size advertised in EDNS0 OPT records, the size recommended by DNS Flag Day
+# 2020 to avoid IP fragmentation. Without EDNS0 UDP messages are limited to
+# MAX_UDP_MESSAGE (RFC 1035 Section 4.2.1).
+EDNS_PAYLOAD = 1232
+MAX_UDP_MESSAGE = 512
+
+# Largest message that fits the 16 bit length prefix used over TCP (RFC 1035 Section 4.2.2).
+MAX_MESSAGE = 65535
+
+# Compression pointers hold a 14 bit offset, names written further into a message can not
+# be pointed to.
+MAX_POINTER = 0x3FFF
+
+# Number of names whose label sequences are kept by nameParts.
+MAX_CACHED_NAMES = 4096
+
+# Random transaction IDs are taken from a block of os.urandom output, refilled when used up.
+ID_BLOCK = 1024
+
+randomIds = array('H')
+
+def randomId():
+    if len(randomIds) == 0:
+        randomIds.frombytes(os.urandom(ID_BLOCK * 2))
+    return randomIds.pop()
+
+cachedNames = {}
+
+def nameParts(name):
+    # Returns the labels of name as a tuple of (lowercase suffix starting at the label,
+    # wire encoded label), the form the encoder compresses names with.
+    parts = cachedNames.get(name)
+    if parts is not None:
+        return parts
+
+    labels = [label for label in name.rstrip('.').split('.') if len(label) > 0]
+    parts = []
+    for count in range(0, len(labels)):
+        label = labels[count].encode()
+        if len(label) > 63:
+            raise ValueError("label longer than 63 octets")
+        parts.append(('.'.join(labels[count:]).lower() + '.', bytes([len(label)]) + label))
+    parts = tuple(parts)
+
+    if len(cachedNames) >= MAX_CACHED_NAMES:
+        cachedNames.clear()
+    cachedNames[name] = parts
+    return parts
+
+class MessageEncoder:
+
+    def __init__(self, size=MAX_MESSAGE):
+        self.buffer = bytearray(size)
+        self.offset = 12
+        self.queryId = 0
+        self.flags = 0
+        self.counts = [0, 0, 0, 0]
+        # Lowercase name suffix -> offset it was written at, for compression.
+        self.names = {}
+
+    def begin(self, queryId, flags):
+        self.offset = 12
+        self.queryId = queryId
+        self.flags = flags
+        self.counts = [0, 0, 0, 0]
+        self.names.clear()
+
+    def write(self, data):
+        end = self.offset + len(data)
+        if end > len(self.buffer):
+            raise ValueError("message too long")
+        self.buffer[self.offset:end] = data
+        self.offset = end
+
+    def writeName(self, name, compress=True):
+        for suffix, label in nameParts(name):
+            pointer = self.names.get(suffix) if compress else None
+            if pointer is not None:
+                self.write(struct.pack('!H', 0xC000 | pointer))
+                return
+            if self.offset <= MAX_POINTER:
+                self.names[suffix] = self.offset
+            self.write(label)
+        self.write(b'\x00')
+
+    def addQuestion(self, name, qtype, qclassInfo):
+        # Question section of query.
+        #                                 1  1  1  1  1  1
+        #   0  1  2  3  4  5  6  7  8  9  0  1  2  3  4  5
+        # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+        # |                                               |
+        # /                     QNAME                     /
+        # /                                               /
+        # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+        # |                     QTYPE                     |
+        # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+        # |                     QCLASS                    |
+        # +--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+--+
+        self.writeName(name)
+        self.write(QUESTION.pack(qtype, qclassInfo))
+        self.counts[0] += 1
+
+    def addRawQuestion(self, question):
+        # Copies a question section taken from a query as is, so the answer echoes the
+        # client's name exactly, and makes its name available for compression.
+        start = self.offset
+        self.write(question)
+        offset = start
+        while self.buffer[offset] != 0 and offset <= MAX_POINTER:
+            self.names.setdefault(readName(self.buffer, offset)[0], offset)
+            offset += self.buffer[offset] + 1
+        self.counts[0] += 1
+
+    def addRecord(self, section, record, ttl):
+        # Appends record to section (1 answer, 2 authority, 3 additional) with the given
+        # TTL. Names inside the RDATA of the RFC 1035 types are compressed as well.
+        self.writeName(record.name)
+        rdlengthOffset = self.offset + 8
+        self.write(RECORD.pack(record.rtype, record.rclass, ttl, 0))
+        rdataStart = self.offset
+        if record.rtype in NAME_RDATA:
+            prefix, names = NAME_RDATA[record.rtype]
+            offset = record.rdataOffset
+            self.write(record.buffer[offset:offset + prefix])
+            offset += prefix
+            for count in range(0, names):
+                name, offset = readName(record.buffer, offset)
+                self.writeName(name)
+            self.write(record.buffer[offset:record.rdataOffset + record.rdlength])
+        else:
+            self.write(record.buffer[record.rdataOffset:record.rdataOffset + record.rdlength])
+        struct.pack_into('!H', self.buffer, rdlengthOffset, self.offset - rdataStart)
+        self.counts[section] += 1
+
+    def addOpt(self, payload, extendedRcode=0, version=0, flags=0):
+        # Appends an EDNS0 OPT pseudo-record (RFC 6891 Section 6.1.2) to the additional
+        # section, without options.
+        self.write(b'\x00')
+        self.write(RECORD.pack(OPT_TYPE, payload, (extendedRcode << 24) | (version << 16) | flags, 0))
+        self.counts[3] += 1
+
+    def finish(self):
+        HEADER.pack_into(self.buffer, 0, self.queryId, self.flags, *self.counts)
+        return bytes(self.buffer[0:self.offset])
+
+# Encoders are only used between awaits, so one per process can be shared by every task.
+sharedEncoder = MessageEncoder()
+
+def createQuery(qtype, name, qclassInfo=1, flags=0, payload=None):
+    # Builds a query with a random transaction ID for name, qtype and qclass given as
+    # numbers, with an EDNS0 OPT record advertising payload if given.
+    sharedEncoder.begin(randomId(), flags)
+    sharedEncoder.addQuestion(name, qtype, qclassInfo)
+    if payload is not None:
+        sharedEncoder.addOpt(payload)
+    return sharedEncoder.finish()
@@ -0,0 +1,66 @@
+from bisect import bisect_left
+
+# Latency histogram with fixed, exponentially spaced buckets, so recording a sample is a
+# binary search and a counter increment, and histograms from different runs or processes
+# can be compared and added up bucket by bucket.
+
+# Upper bounds in seconds: BUCKETS_PER_DOUBLING buckets for every doubling from
+# MIN_LATENCY up to MAX_LATENCY, about 19% apart. Slower samples go in a final overflow
+# bucket.
+MIN_LATENCY = 0.0001
+MAX_LATENCY = 60.0
+BUCKETS_PER_DOUBLING = 4
+
+def bucketBounds():
+    bounds = []
+    bound = MIN_LATENCY
+    while bound < MAX_LATENCY:
+        bounds.append(bound)
+        bound *= 2 ** (1 / BUCKETS_PER_DOUBLING)
+    bounds.append(MAX_LATENCY)
+    return bounds
+
+BOUNDS = bucketBounds()
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of samples, or None if empty.
+        # The overflow bucket reports the largest sample.
+        if self.count == 0:
+            return None
+        rank = max(int(self.count * fraction + 0.5), 1)
+        seen = 0
+        for index in range(0, len(self.counts)):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(BOUNDS[index], self.max) if index < len(BOUNDS) else self.max
+        return self.max
+
+    def merge(self, other):
+        for index in range(0, len(self.counts)):
+            self.counts[index] += other.counts[index]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def buckets(self):
+        # Non empty buckets as (upper bound in seconds, count), None for the overflow bucket.
+        result = []
+        for index in range(0, len(self.counts)):
+            if self.counts[index] > 0:
+                result.append((BOUNDS[index] if index < len(BOUNDS) else None, self.counts[index]))
+        return result
@@ -0,0 +1,265 @@
+import socket
+import struct
+
+# Wire format parser for DNS messages (RFC 1035 Section 4). A message is parsed by walking
+# offsets over a memoryview of the datagram: nothing is sliced or decoded while parsing,
+# each record is kept as offsets and fixed fields, and names and RDATA are only decoded
+# when a caller asks for them. Every call returns a fresh Message, so parsing is safe to
+# use from concurrent resolutions.
+
+HEADER = struct.Struct('!HHHHHH')
+QUESTION = struct.Struct('!HH')
+RECORD = struct.Struct('!HHLH')
+
+# A name is at most 255 octets long (RFC 1035 Section 2.3.4), so no valid name can need
+# more compression pointers than this.
+MAX_POINTERS = 127
+MAX_NAME_LENGTH = 255
+
+# Type of the OPT pseudo-record carrying EDNS0 (RFC 6891 Section 6.1). Its CLASS field holds
+# the sender's UDP payload size and its TTL the extended RCODE, version and flags.
+OPT_TYPE = 41
+
+def skipName(data, offset):
+    # Returns the offset just past the name starting at offset, without decoding it.
+    length = len(data)
+    while True:
+        if offset >= length:
+            raise ValueError("name runs past end of message")
+        labelLength = data[offset]
+        if labelLength == 0:
+            return offset + 1 # Null terminator reached
+        if labelLength & 0xC0 == 0xC0:
+            if offset + 2 > length:
+                raise ValueError("name runs past end of message")
+            return offset + 2 # Pointer is 2 octet and always ends a name.
+        if labelLength & 0xC0:
+            raise ValueError("unsupported label type")
+        offset += labelLength + 1
+
+def readName(data, offset):
+    # Decodes the name starting at offset, following compression pointers (RFC 1035
+    # Section 4.1.4). Returns (name, offset just past the name). Names are lowercase and end
+    # in '.', the root is '.'.
+    name = bytearray()
+    end = None
+    pointers = 0
+    segmentStart = offset
+    length = len(data)
+    while True:
+        if offset >= length:
+            raise ValueError("name runs past end of message")
+        labelLength = data[offset]
+        if labelLength == 0:
+            if end is None:
+                end = offset + 1
+            break
+        if labelLength & 0xC0 == 0xC0:
+            if offset + 2 > length:
+                raise ValueError("name runs past end of message")
+            pointer = ((labelLength & 0x3F) << 8) | data[offset + 1]
+            if end is None:
+                end = offset + 2
+            # Pointers may only point to a prior occurrence of a name, before the labels read
+            # since the last jump, so a chain of them always terminates.
+            pointers += 1
+            if pointer >= segmentStart or pointers > MAX_POINTERS:
+                raise ValueError("compression pointer loop")
+            offset = pointer
+            segmentStart = pointer
+            continue
+        if labelLength & 0xC0:
+            raise ValueError("unsupported label type")
+        name += data[offset + 1:offset + 1 + labelLength]
+        name += b'.'
+        offset += labelLength + 1
+        if len(name) > MAX_NAME_LENGTH:
+            raise ValueError("name too long")
+
+    if len(name) == 0:
+        return ('.', end)
+    return (name.lower().decode('ascii', 'backslashreplace'), end)
+
+def nameToWire(name):
+    # Uncompressed wire form of a name, a sequence of length prefixed labels ending in a
+    # zero octet.
+    wire = bytearray()
+    for label in name.rstrip('.').split('.'):
+        if len(label) > 0:
+            wire.append(len(label))
+            wire += label.encode()
+    wire.append(0)
+    return bytes(wire)
+
+# Record types whose RDATA holds domain names, as (octets before the first name, number of
+# names). Those names may be compressed, so the RDATA is only meaningful inside its message
+# until ResourceRecord.detach expands them.
+NAME_RDATA = {
+    2: (0, 1), # NS
+    5: (0, 1), # CNAME
+    6: (0, 2), # SOA
+    12: (0, 1), # PTR
+    15: (2, 1), # MX
+}
+
+# Octets of fixed size RDATA fields the resolver decodes, following the names if any: the
+# address of an A record and the five counters of an SOA record.
+FIXED_RDATA = {
+    1: 4, # A
+    6: 20, # SOA
+}
+
+class ResourceRecord:
+    # A resource record (RFC 1035 Section 4.1.3) seen through the buffer it was parsed
+    # from. Nothing is copied or decoded until asked for.
+    __slots__ = ('buffer', 'nameOffset', 'rtype', 'rclass', 'ttl', 'rdataOffset', 'rdlength')
+
+    def __init__(self, buffer, nameOffset, rtype, rclass, ttl, rdataOffset, rdlength):
+        self.buffer = buffer
+        self.nameOffset = nameOffset
+        self.rtype = rtype
+        self.rclass = rclass
+        self.ttl = ttl
+        self.rdataOffset = rdataOffset
+        self.rdlength = rdlength
+
+    @property
+    def name(self):
+        return readName(self.buffer, self.nameOffset)[0]
+
+    @property
+    def rdata(self):
+        return bytes(self.buffer[self.rdataOffset:self.rdataOffset + self.rdlength])
+
+    def address(self):
+        # RDATA of an A record, a 32 bit internet address.
+        return socket.inet_ntoa(self.buffer[self.rdataOffset:self.rdataOffset + 4])
+
+    def target(self):
+        # RDATA of NS, CNAME, PTR and similar records, a single domain name.
+        return readName(self.buffer, self.rdataOffset)[0]
+
+    def mx(self):
+        # RDATA of an MX record, (preference, exchange).
+        preference = struct.unpack_from('!H', self.buffer, self.rdataOffset)[0]
+        return (preference, readName(self.buffer, self.rdataOffset + 2)[0])
+
+    def soa(self):
+        # RDATA of an SOA record, (mname, rname, serial, refresh, retry, expire, minimum).
+        mname, offset = readName(self.buffer, self.rdataOffset)
+        rname, offset = readName(self.buffer, offset)
+        return (mname, rname) + struct.unpack_from('!LLLLL', self.buffer, offset)
+
+    def check(self):
+        # Raises ValueError unless the owner name and the RDATA fields the resolver reads
+        # decode, with the RDATA fields lying within rdlength.
+        readName(self.buffer, self.nameOffset)
+        end = self.rdataOffset
+        if self.rtype in NAME_RDATA:
+            prefix, names = NAME_RDATA[self.rtype]
+            end += prefix
+            for count in range(0, names):
+                end = readName(self.buffer, end)[1]
+        if end + FIXED_RDATA.get(self.rtype, 0) > self.rdataOffset + self.rdlength:
+            raise ValueError("rdata runs past its length")
+
+    def detach(self):
+        # Returns a copy backed by its own small buffer (owner name and RDATA with names
+        # expanded), so it can outlive the message it came from, e.g. in a cache.
+        wire = bytearray(nameToWire(self.name))
+        rdataOffset = len(wire)
+        if self.rtype in NAME_RDATA:
+            prefix, names = NAME_RDATA[self.rtype]
+            offset = self.rdataOffset
+            wire += self.buffer[offset:offset + prefix]
+            offset += prefix
+            for count in range(0, names):
+                name, offset = readName(self.buffer, offset)
+                wire += nameToWire(name)
+            wire += self.buffer[offset:self.rdataOffset + self.rdlength]
+        else:
+            wire += self.buffer[self.rdataOffset:self.rdataOffset + self.rdlength]
+        return ResourceRecord(bytes(wire), 0, self.rtype, self.rclass, self.ttl, rdataOffset, len(wire) - rdataOffset)
+
+class Message:
+    # A parsed DNS message. Questions are (name offset, qtype, qclass), the three record
+    # sections are lists of ResourceRecord viewing data.
+    __slots__ = ('data', 'id', 'flags', 'questions', 'answers', 'authority', 'additional', 'end')
+
+    def __init__(self, data, queryId, flags, questions, answers, authority, additional, end):
+        self.data = data
+        self.id = queryId
+        self.flags = flags
+        self.questions = questions
+        self.answers = answers
+        self.authority = authority
+        self.additional = additional
+        self.end = end
+
+    @property
+    def rcode(self):
+        return self.flags & 0xF
+
+    @property
+    def tc(self):
+        return (self.flags >> 9) & 0x1
+
+    @property
+    def qname(self):
+        return readName(self.data, self.questions[0][0])[0]
+
+    @property
+    def opt(self):
+        # The OPT record of the message, or None if the sender does not use EDNS0.
+        for record in self.additional:
+            if record.rtype == OPT_TYPE:
+                return record
+        return None
+
+    def check(self):
+        # Checks every record (ResourceRecord.check), as the names and RDATA of records are
+        # only decoded when asked for. Raises ValueError if one is malformed.
+        for section in (self.answers, self.authority, self.additional):
+            for record in section:
+                record.check()
+
+    @property
+    def wire(self):
+        # The message as received, without copying it.
+        return self.data.obj
+
+def parseMessage(response):
+    # Parses a complete message. Raises ValueError if it is truncated or malformed.
+    data = memoryview(response)
+    if len(data) < 12:
+        raise ValueError("message shorter than header")
+    queryId, flags, qCount, ansCount, nsCount, arCount = HEADER.unpack_from(data, 0)
+
+    offset = 12
+    questions = []
+    for count in range(0, qCount):
+        nameOffset = offset
+        offset = skipName(data, offset)
+        if offset + 4 > len(data):
+            raise ValueError("question runs past end of message")
+        qType, qClassData = QUESTION.unpack_from(data, offset)
+        questions.append((nameOffset, qType, qClassData))
+        offset += 4
+
+    sections = []
+    for sectionCount in (ansCount, nsCount, arCount):
+        records = []
+        for count in range(0, sectionCount):
+            nameOffset = offset
+            offset = skipName(data, offset)
+            if offset + 10 > len(data):
+                raise ValueError("record runs past end of message")
+            ansType, ansClass, ansTTL, ansRdlength = RECORD.unpack_from(data, offset)
+            offset += 10
+            if offset + ansRdlength > len(data):
+                raise ValueError("rdata runs past end of message")
+            records.append(ResourceRecord(data, nameOffset, ansType, ansClass, ansTTL, offset, ansRdlength))
+            offset += ansRdlength
+        sections.append(records)
+
+    return Message(data, queryId, flags, questions, sections[0], sections[1], sections[2], offset)
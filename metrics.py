@@ -0,0 +1,161 @@
+import asyncio
+import re
+from helpers import rcodeTypes
+from histogram import LatencyHistogram, BOUNDS
+
+# Resolver instrumentation, served over HTTP in the Prometheus text format (version 0.0.4)
+# on a local port. Recording is a counter increment or a histogram insert (see
+# histogram.py); everything else, such as the cache and admission statistics, is only
+# gathered when the metrics are scraped.
+#
+# Latency histograms are kept per stage of answering a query:
+#
+#   total       end to end, from receiving a client query to the answer being ready
+#   queue       waiting for an admission slot (see admission.py)
+#   resolution  iterative resolution of a cache miss, glueless lookups included
+#   upstream    round trip of one UDP query to a root or authoritative server
+#   tcp         exchange of one query over TCP, after a truncated reply
+#   parse       parsing an upstream reply
+#   glue        finding the addresses of a delegation that came without glue
+#   cname       following a CNAME chain
+
+STAGES = ('total', 'queue', 'resolution', 'upstream', 'tcp', 'parse', 'glue', 'cname')
+
+# Upstream timeouts are counted per server address for at most this many servers, the rest
+# are counted under "other".
+MAX_SERVER_LABELS = 1000
+
+METRICS_TIMEOUT = 5.0
+
+class Metrics:
+
+    def __init__(self):
+        self.queries = {'udp': 0, 'tcp': 0}
+        self.rcodes = {}
+        self.upstreamTimeouts = {}
+        # Referrals followed and iterative walks run, for the mean number of hops a walk
+        # takes, per walk kind: 'client' for client questions, 'glue' for glueless lookups.
+        self.referrals = {'client': 0, 'glue': 0}
+        self.walks = {'client': 0, 'glue': 0}
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+
+    def record(self, stage, seconds):
+        self.stages[stage].record(seconds)
+
+    def recordResponse(self, response, seconds, udp):
+        self.queries['udp' if udp else 'tcp'] += 1
+        rcode = response[3] & 0xF if len(response) >= 12 else None
+        self.rcodes[rcode] = self.rcodes.get(rcode, 0) + 1
+        self.stages['total'].record(seconds)
+
+    def recordTimeout(self, server):
+        if server not in self.upstreamTimeouts and len(self.upstreamTimeouts) >= MAX_SERVER_LABELS:
+            server = 'other'
+        self.upstreamTimeouts[server] = self.upstreamTimeouts.get(server, 0) + 1
+
+def snakeCase(name):
+    return re.sub(r'([A-Z])', lambda match: '_' + match.group(1).lower(), name)
+
+class MetricsWriter:
+    # Builds a page of metrics in the Prometheus text format.
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, description):
+        self.lines.append(f"# HELP {name} {description}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name, value, labels=None):
+        if labels:
+            labelText = ','.join([f'{key}="{labelValue}"' for key, labelValue in labels.items()])
+            self.lines.append(f"{name}{{{labelText}}} {value}")
+        else:
+            self.lines.append(f"{name} {value}")
+
+    def metric(self, name, kind, description, value):
+        self.family(name, kind, description)
+        self.sample(name, value)
+
+    def stats(self, prefix, description, stats):
+        # A statistics dictionary such as AnswerCache.stats(), one untyped metric per field.
+        for field, value in stats.items():
+            self.metric(f"{prefix}_{snakeCase(field)}", 'untyped', f"{description}: {field}.", value)
+
+    def histogram(self, name, labels, histogram):
+        cumulative = 0
+        for index in range(0, len(BOUNDS)):
+            cumulative += histogram.counts[index]
+            self.sample(name + '_bucket', cumulative, dict(labels, le=format(BOUNDS[index], '.6g')))
+        self.sample(name + '_bucket', histogram.count, dict(labels, le='+Inf'))
+        self.sample(name + '_sum', round(histogram.sum, 6), labels)
+        self.sample(name + '_count', histogram.count, labels)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+def renderMetrics(resolver, tcpServer=None):
+    # The metrics page of a running resolver.
+    metrics = resolver.metrics
+    writer = MetricsWriter()
+
+    writer.family('dns_queries_total', 'counter', "Client queries answered, by transport.")
+    for transport, count in metrics.queries.items():
+        writer.sample('dns_queries_total', count, {'transport': transport})
+    writer.family('dns_responses_total', 'counter', "Answers sent to clients, by RCODE.")
+    for rcode, count in metrics.rcodes.items():
+        writer.sample('dns_responses_total', count, {'rcode': rcodeTypes.get(rcode, str(rcode)) if rcode is not None else 'TIMEOUT'})
+    writer.family('dns_upstream_timeouts_total', 'counter', "UDP queries to a server that went unanswered within its RTO.")
+    for server, count in metrics.upstreamTimeouts.items():
+        writer.sample('dns_upstream_timeouts_total', count, {'server': server})
+    writer.family('dns_referrals_total', 'counter', "Referrals followed by iterative walks.")
+    for kind, count in metrics.referrals.items():
+        writer.sample('dns_referrals_total', count, {'walk': kind})
+    writer.family('dns_walks_total', 'counter', "Iterative walks run.")
+    for kind, count in metrics.walks.items():
+        writer.sample('dns_walks_total', count, {'walk': kind})
+
+    writer.metric('dns_coalesced_queries_total', 'counter', "Client queries that joined a resolution in progress.", resolver.coalesced)
+    writer.metric('dns_prefetches_total', 'counter', "Cache entries refreshed before expiry.", resolver.prefetches)
+    writer.metric('dns_stale_answers_total', 'counter', "Answers served stale.", resolver.staleAnswers)
+    writer.metric('dns_truncated_answers_total', 'counter', "UDP answers truncated to the client's size.", resolver.truncatedAnswers)
+    writer.metric('dns_cname_lookups_total', 'counter', "Names looked up while following CNAME chains.", resolver.cnameLookups)
+    writer.metric('dns_root_primes_total', 'counter', "Successful root priming queries.", resolver.primes)
+    writer.stats('dns_answer_cache', "Answer cache", resolver.answerCache.stats())
+    writer.stats('dns_delegation_cache', "Delegation cache", resolver.delegationCache.stats())
+    writer.stats('dns_admission', "Admission control", resolver.admission.stats())
+    writer.stats('dns_upstream_tcp', "Upstream TCP connections", resolver.tcpPool.stats())
+    if tcpServer is not None:
+        writer.stats('dns_tcp_clients', "TCP clients", tcpServer.stats())
+
+    writer.family('dns_stage_seconds', 'histogram', "Time spent per stage of answering queries.")
+    for stage, histogram in metrics.stages.items():
+        writer.histogram('dns_stage_seconds', {'stage': stage}, histogram)
+    return writer.text()
+
+class MetricsServer:
+    # Minimal HTTP/1.0 server for the metrics page, for a Prometheus scraper or curl.
+
+    def __init__(self, render):
+        self.render = render
+
+    async def handleConnection(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), METRICS_TIMEOUT)
+            fields = request.split(b' ')
+            if len(fields) > 1 and fields[0] == b'GET' and fields[1] in (b'/', b'/metrics'):
+                status, body = '200 OK', self.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def serveMetrics(port, render):
+    # Serves the page returned by render on port, on the loopback interface only.
+    server = MetricsServer(render)
+    return await asyncio.start_server(server.handleConnection, '127.0.0.1', port)
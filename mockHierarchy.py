@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import sys
+import zlib
+from message import parseMessage, nameToWire, skipName, ResourceRecord
+from encoder import sharedEncoder, QR, AA, TC, RD, MAX_UDP_MESSAGE
+from cache import isSubdomain
+
+# Offline stand-in for the DNS hierarchy, for benchmarks and tests that must not depend on
+# the live root servers. Zones are synthesized for a list of names (dlist4000.txt by default)
+# and served by authoritative servers on loopback addresses:
+#
+#   127.1.0.x   root servers, serving '.'
+#   127.2.x.y   two servers per top level domain
+#   127.3.x.y   leaf servers, each serving many of the listed names as zones
+#   127.4.0.1   the "mock-dns.net." provider zone, home of the NS names of glueless zones
+#
+# Every listed name becomes a zone delegated from its top level domain, with an SOA, NS, A
+# and MX record at its apex and A records for www and mail. Servers answer as described in
+# RFC 1034 Section 4.3.2: an answer, a referral or NXDOMAIN/NODATA with the zone's SOA.
+# Latency, packet loss, truncation and lame delegations are configurable, globally or per
+# server. A root hints file in named.root format is written for the resolver.
+#
+# Addresses other than 127.0.0.1 are routed to loopback by Linux without configuration, on
+# other systems they have to be added to the loopback interface first.
+
+MOCK_PORT = 5353
+ROOT_SERVERS = 3
+LEAF_SERVERS = 16
+PROVIDER_ZONE = 'mock-dns.net.'
+PROVIDER_ADDRESS = '127.4.0.1'
+
+TTL = 3600
+NEGATIVE_TTL = 300
+DELEGATION_TTL = 86400
+
+# UDP payload size the servers advertise and accept with EDNS0. Replies longer than the
+# client's payload size, or MAX_UDP_MESSAGE without EDNS0, are truncated.
+EDNS_PAYLOAD = 4096
+
+def makeRecord(name, rtype, ttl, rdata):
+    wire = nameToWire(name)
+    return ResourceRecord(wire + rdata, 0, rtype, 1, ttl, len(wire), len(rdata))
+
+def aRecord(name, address):
+    return makeRecord(name, 1, TTL, socket.inet_aton(address))
+
+def syntheticAddress(name):
+    # Stable documentation style address for a synthesized A record.
+    crc = zlib.crc32(name.encode())
+    return f"10.{(crc >> 16) & 0xFF}.{(crc >> 8) & 0xFF}.{crc & 0xFF or 1}"
+
+class Zone:
+
+    def __init__(self, name, nsNames):
+        self.name = name
+        self.nsNames = nsNames
+        # owner name -> rtype -> list of ResourceRecord
+        self.records = {}
+        # child zone -> NS names, for delegations out of this zone.
+        self.cuts = {}
+        soa = nameToWire(nsNames[0]) + nameToWire('hostmaster.' + name) + struct.pack('!LLLLL', 1, 3600, 600, 86400, NEGATIVE_TTL)
+        self.soa = makeRecord(name, 6, TTL, soa)
+        self.add(self.soa)
+        for nsName in nsNames:
+            self.add(makeRecord(name, 2, TTL, nameToWire(nsName)))
+
+    def add(self, record):
+        self.records.setdefault(record.name, {}).setdefault(record.rtype, []).append(record)
+
+class Faults:
+    # Misbehaviour of one server. Latency and jitter are in seconds, loss and truncate are
+    # probabilities per query.
+    __slots__ = ('latency', 'jitter', 'loss', 'truncate')
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, truncate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.truncate = truncate
+
+    def copy(self):
+        return Faults(self.latency, self.jitter, self.loss, self.truncate)
+
+class Hierarchy:
+    # Zone data of every mock server, keyed by address.
+
+    def __init__(self, names, leafServers=LEAF_SERVERS, glueless=0.0, lame=0.0, seed=0):
+        self.rng = random.Random(seed)
+        self.zones = {} # zone name -> Zone
+        self.servers = {} # address -> list of zone names served
+        self.roles = {} # address -> 'root', 'tld', 'leaf' or 'provider'
+        self.hosts = {} # nameserver name -> address
+        self.tldCount = 0
+
+        rootNames = [f"{chr(ord('a') + count)}.root-servers.mock." for count in range(0, ROOT_SERVERS)]
+        for count in range(0, ROOT_SERVERS):
+            self.addServer(rootNames[count], f"127.1.0.{count + 1}", 'root')
+        self.addZone('.', rootNames)
+
+        leafAddresses = [f"127.3.{count // 250}.{count % 250 + 1}" for count in range(0, leafServers)]
+        for address in leafAddresses:
+            self.roles[address] = 'leaf'
+            self.servers[address] = []
+        providerNames = ['ns.' + PROVIDER_ZONE]
+        self.addServer(providerNames[0], PROVIDER_ADDRESS, 'provider')
+        self.delegate(PROVIDER_ZONE, providerNames)
+        for count in range(0, leafServers):
+            nsName = f"ns{count + 1}.{PROVIDER_ZONE}"
+            self.hosts[nsName] = leafAddresses[count]
+            self.zones[PROVIDER_ZONE].add(aRecord(nsName, leafAddresses[count]))
+
+        # Parents first, so a listed name below another listed name becomes records of that
+        # zone rather than a second delegation.
+        names = sorted(set([name.strip().lower().rstrip('.') + '.' for name in names if len(name.strip()) > 0]),
+            key=lambda name: name.count('.'))
+        for name in names:
+            if name.count('.') < 2 or name in self.zones:
+                continue
+            parent = self.closestZone(name)
+            if parent.count('.') > 1:
+                self.addHostRecords(self.zones[parent], name)
+            else:
+                self.addLeaf(name, leafAddresses, glueless, lame)
+
+    def addServer(self, nsName, address, role):
+        self.hosts[nsName] = address
+        self.roles[address] = role
+        self.servers.setdefault(address, [])
+
+    def addZone(self, name, nsNames):
+        zone = Zone(name, nsNames)
+        self.zones[name] = zone
+        for nsName in nsNames:
+            address = self.hosts[nsName]
+            if name not in self.servers[address]:
+                self.servers[address].append(name)
+            if isSubdomain(nsName, name):
+                zone.add(aRecord(nsName, address))
+        return zone
+
+    def delegate(self, name, nsNames):
+        # Creates zone name, creating its top level domain first if needed, and delegates it
+        # from its parent.
+        parent = '.' if name.count('.') == 1 else self.tld(name)
+        self.zones[parent].cuts[name] = nsNames
+        return self.addZone(name, nsNames)
+
+    def tld(self, name):
+        tld = name.rstrip('.').split('.')[-1] + '.'
+        if tld not in self.zones:
+            index = self.tldCount
+            self.tldCount += 1
+            nsNames = ['a.nic.' + tld, 'b.nic.' + tld]
+            self.addServer(nsNames[0], f"127.2.{index // 250}.{index % 250 + 1}", 'tld')
+            self.addServer(nsNames[1], f"127.2.{128 + index // 250}.{index % 250 + 1}", 'tld')
+            self.delegate(tld, nsNames)
+        return tld
+
+    def closestZone(self, name):
+        while name not in self.zones:
+            name = name.split('.', 1)[1] if name.count('.') > 1 else '.'
+        return name
+
+    def addLeaf(self, name, leafAddresses, glueless, lame):
+        first = zlib.crc32(name.encode()) % len(leafAddresses)
+        chosen = [first, (first + 1) % len(leafAddresses)]
+        if self.rng.random() < glueless:
+            nsNames = [f"ns{index + 1}.{PROVIDER_ZONE}" for index in chosen]
+        else:
+            nsNames = ['ns1.' + name, 'ns2.' + name]
+            for count in range(0, 2):
+                self.hosts[nsNames[count]] = leafAddresses[chosen[count]]
+        if self.rng.random() < lame:
+            # A lame delegation: the parent lists a server that does not serve the zone.
+            lameIndex = (first + len(leafAddresses) // 2) % len(leafAddresses)
+            if lameIndex not in chosen:
+                nsNames.insert(0, f"ns{lameIndex + 1}.{PROVIDER_ZONE}")
+
+        self.tld(name)
+        zone = Zone(name, nsNames)
+        self.zones[name] = zone
+        self.zones[self.tld(name)].cuts[name] = nsNames
+        for index in chosen:
+            self.servers[leafAddresses[index]].append(name)
+        for nsName in nsNames:
+            if isSubdomain(nsName, name):
+                zone.add(aRecord(nsName, self.hosts[nsName]))
+        self.addHostRecords(zone, name)
+
+    def addHostRecords(self, zone, name):
+        zone.add(aRecord(name, syntheticAddress(name)))
+        zone.add(makeRecord(name, 15, TTL, struct.pack('!H', 10) + nameToWire('mail.' + name)))
+        zone.add(aRecord('www.' + name, syntheticAddress('www.' + name)))
+        zone.add(aRecord('mail.' + name, syntheticAddress('mail.' + name)))
+
+    def writeHints(self, fileName):
+        # Root hints in the layout of named.root, readable by Resolver.readRootHints.
+        with open(fileName, 'w') as f:
+            f.write(";       Root hints of the mock DNS hierarchy, written by mockHierarchy.py\n")
+            for nsName in self.zones['.'].nsNames:
+                f.write(f".                        3600000      NS    {nsName.upper()}\n")
+                f.write(f"{nsName.upper()}      3600000      A     {self.hosts[nsName]}\n")
+
+    def answer(self, address, query):
+        # Returns the reply of the server at address to query, following RFC 1034 Section
+        # 4.3.2, or None to stay silent.
+        try:
+            message = parseMessage(query)
+        except ValueError:
+            return None
+        if message.flags & QR or len(message.questions) != 1:
+            return None
+        qname = message.qname
+        qtype = message.questions[0][1]
+        encoder = sharedEncoder
+        flags = QR | (message.flags & RD)
+        question = query[12:skipName(query, 12) + 4]
+        opt = message.opt
+
+        def finish():
+            # Clients using EDNS0 get an OPT record back, after every other record.
+            if opt is not None:
+                encoder.addOpt(EDNS_PAYLOAD)
+            return encoder.finish()
+
+        served = [zone for zone in self.servers.get(address, []) if isSubdomain(qname, zone)]
+        if len(served) == 0:
+            encoder.begin(message.id, flags | 5) # REFUSED, the server is lame for this name.
+            encoder.addRawQuestion(question)
+            return finish()
+        zone = self.zones[max(served, key=len)]
+
+        # Delegation to a child zone, the highest cut between the zone and qname.
+        labels = qname.rstrip('.').split('.')
+        zoneLabels = 0 if zone.name == '.' else zone.name.count('.')
+        for count in range(len(labels) - zoneLabels - 1, -1, -1):
+            candidate = '.'.join(labels[count:]) + '.'
+            if candidate in zone.cuts:
+                encoder.begin(message.id, flags)
+                encoder.addRawQuestion(question)
+                nsNames = zone.cuts[candidate]
+                for nsName in nsNames:
+                    encoder.addRecord(2, makeRecord(candidate, 2, DELEGATION_TTL, nameToWire(nsName)), DELEGATION_TTL)
+                for nsName in nsNames:
+                    if isSubdomain(nsName, candidate) or zone.name == '.':
+                        encoder.addRecord(3, aRecord(nsName, self.hosts[nsName]), DELEGATION_TTL)
+                return finish()
+
+        encoder.begin(message.id, flags | AA)
+        encoder.addRawQuestion(question)
+        records = zone.records.get(qname)
+        if records is None:
+            encoder.flags |= 3 # NXDOMAIN
+            encoder.addRecord(2, zone.soa, NEGATIVE_TTL)
+        elif qtype in records:
+            for record in records[qtype]:
+                encoder.addRecord(1, record, record.ttl)
+            if qtype == 2:
+                for record in records[qtype]:
+                    target = record.target()
+                    if target in self.hosts:
+                        encoder.addRecord(3, aRecord(target, self.hosts[target]), TTL)
+        elif 5 in records:
+            encoder.addRecord(1, records[5][0], records[5][0].ttl)
+        else:
+            encoder.addRecord(2, zone.soa, NEGATIVE_TTL) # NODATA
+        return finish()
+
+def udpLimit(query):
+    # Largest UDP reply the sender of query accepts.
+    try:
+        opt = parseMessage(query).opt
+    except ValueError:
+        return MAX_UDP_MESSAGE
+    return MAX_UDP_MESSAGE if opt is None else min(max(opt.rclass, MAX_UDP_MESSAGE), EDNS_PAYLOAD)
+
+class MockServer(asyncio.DatagramProtocol):
+
+    def __init__(self, hierarchy, address, faults):
+        self.hierarchy = hierarchy
+        self.address = address
+        self.faults = faults
+        self.transport = None
+        self.queries = 0
+        self.dropped = 0
+        self.truncated = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def delay(self):
+        return self.faults.latency + random.uniform(0, self.faults.jitter)
+
+    def datagram_received(self, data, address):
+        self.queries += 1
+        if random.random() < self.faults.loss:
+            self.dropped += 1
+            return
+        reply = self.hierarchy.answer(self.address, data)
+        if reply is None:
+            return
+        if len(reply) > udpLimit(data) or random.random() < self.faults.truncate:
+            # Header and question only with TC set, the client has to retry over TCP.
+            self.truncated += 1
+            flags = struct.unpack_from('!H', reply, 2)[0]
+            reply = reply[0:2] + struct.pack('!HHHHH', flags | TC, 1, 0, 0, 0) + data[12:skipName(data, 12) + 4]
+        delay = self.delay()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.send, reply, address)
+        else:
+            self.send(reply, address)
+
+    def send(self, reply, address):
+        if not self.transport.is_closing():
+            self.transport.sendto(reply, address)
+
+    async def handleTcp(self, reader, writer):
+        # DNS over TCP (RFC 1035 Section 4.2.2), answering queries in order until the client
+        # closes the connection. Never truncated, but latency and loss apply.
+        try:
+            while True:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+                data = await reader.readexactly(length)
+                self.queries += 1
+                if random.random() < self.faults.loss:
+                    self.dropped += 1
+                    continue
+                reply = self.hierarchy.answer(self.address, data)
+                if reply is None:
+                    continue
+                await asyncio.sleep(self.delay())
+                writer.write(struct.pack('!H', len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def parseFaults(spec, faults):
+    # Applies "latency=0.05,loss=0.1" style settings to faults.
+    for setting in spec.split(','):
+        field, separator, value = setting.partition('=')
+        if field not in Faults.__slots__ or not separator:
+            raise ValueError(f"unknown fault setting {setting}")
+        setattr(faults, field, float(value))
+
+async def serve(hierarchy, port, defaults, overrides):
+    loop = asyncio.get_running_loop()
+    servers = []
+    closers = []
+    for address in sorted(hierarchy.servers):
+        faults = defaults.copy()
+        for target, spec in overrides:
+            if target == address or target == hierarchy.roles[address]:
+                parseFaults(spec, faults)
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: MockServer(hierarchy, address, faults), local_addr=(address, port), family=socket.AF_INET)
+        tcpServer = await asyncio.start_server(protocol.handleTcp, address, port)
+        servers.append(protocol)
+        closers += [transport, tcpServer]
+    print(f"Serving {len(hierarchy.zones)} zones on {len(servers)} servers, port {port}", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for closer in closers:
+            closer.close()
+        queries = sum([server.queries for server in servers])
+        dropped = sum([server.dropped for server in servers])
+        truncated = sum([server.truncated for server in servers])
+        print(f"Queries: {queries}, dropped: {dropped}, truncated: {truncated}", file=sys.stderr)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python3 mockHierarchy.py [--names=dlist4000.txt] [--port=5353] [--hints=mock.root] [--latency=0] [--loss=0] [--server=ROLE|ADDRESS:SETTINGS]")
+    parser.add_argument('--names', default='dlist4000.txt', help="names to synthesize zones for")
+    parser.add_argument('--port', type=int, default=MOCK_PORT)
+    parser.add_argument('--hints', default='mock.root', help="root hints file to write for Resolver.py --root-hints")
+    parser.add_argument('--leaf-servers', type=int, default=LEAF_SERVERS)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every reply")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many seconds added at random")
+    parser.add_argument('--loss', type=float, default=0.0, help="fraction of queries dropped")
+    parser.add_argument('--truncate', type=float, default=0.0, help="fraction of UDP replies truncated")
+    parser.add_argument('--glueless', type=float, default=0.0, help="fraction of zones delegated without glue")
+    parser.add_argument('--lame', type=float, default=0.0, help="fraction of zones with a lame nameserver")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--server', action='append', default=[],
+        help="per server faults, e.g. tld:latency=0.05 or 127.1.0.1:loss=1 (roles: root, tld, leaf, provider)")
+    args = parser.parse_args()
+
+    with open(args.names, 'r') as f:
+        hierarchy = Hierarchy(f.readlines(), args.leaf_servers, args.glueless, args.lame, args.seed)
+    hierarchy.writeHints(args.hints)
+    defaults = Faults(args.latency, args.jitter, args.loss, args.truncate)
+    overrides = [tuple(spec.split(':', 1)) for spec in args.server]
+
+    try:
+        asyncio.run(serve(hierarchy, args.port, defaults, overrides))
+    except KeyboardInterrupt:
+        pass
@@ -1,104 +1,161 @@
+import argparse
+import asyncio
+import json
 import subprocess
-import time
 import sys
+import time
+from batchClient import BatchClient
+from helpers import rcodeTypes
+from histogram import LatencyHistogram
+
+# Load generator and latency benchmark. Queries are sent from this process over one socket
+# (see batchClient.py), either at a fixed rate or with a fixed number outstanding, so the
+# measured times are resolution times rather than interpreter start up.
+#
+# Every phase queries the same names. With --resolver=ours a fresh Resolver.py is started
+# first, so the first phase runs against a cold cache and the following ones warm. Other
+# resolvers are shared and may already have the names cached.
+
+RESOLVERS = {
+    'google': ('8.8.8.8', 53),
+    'cloudfare': ('1.1.1.1', 53),
+    'cloudflare': ('1.1.1.1', 53),
+}
 
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
 
-def readDlist():
+# Time given to a started Resolver.py to bind its port.
+RESOLVER_STARTUP = 1.0
+
+def readDlist(fileName, count):
     domainNames = []
-    with open("dlist4000.txt", 'r') as dList:
+    with open(fileName, 'r') as dList:
         for domain in dList:
-            domainNames.append(domain.strip())
-    return domainNames
-
-def runClient():
-    dnsResolverCommand = ['python3', 'Resolver.py', '5500', '5']
-    dnsResolverProcess = subprocess.Popen(dnsResolverCommand) # Start resolver
-    timeOutCounts = 0
-    data = readDlist()
-    for _ in range(2):
-        for domain in data:
-            command = ['python3', 'Client.py', '127.0.0.1', '5500', str(domain), 'A', '4']
-            process = subprocess.run(command, capture_output=True, text=True)
-            with open("performance/domains.txt", 'a+') as f:
-                f.write(domain + "\n")
-            with open("performance/resolutionTimes.txt", 'a+') as f2:
-                f2.write(process.stdout.split(" ")[-2] + "\n")
-            if float(process.stdout.split(" ")[-2]) > 4:
-                timeOutCounts += 1
-            if timeOutCounts > 3:
-                dnsResolverProcess.terminate()
-                dnsResolverProcess = subprocess.Popen(dnsResolverCommand) # restart resolver incase of overload on resolver or dns servers from too many queries.
-            if domain == data[2499]:
-                break
-
-def runGoogleDNS():
-    timeOutCounts = 0
-    data = readDlist()
-    for _ in range(2):
-        for domain in data:
-            command = ['python3', 'Client.py', '8.8.8.8', '53', str(domain), 'A', '4']
-            process = subprocess.run(command, capture_output=True, text=True)
-            with open("performance/googleDNSDomains.txt", 'a+') as f:
-                f.write(domain + "\n")
-            with open("performance/googleDNSResolutionTimes.txt", 'a+') as f2:
-                f2.write(process.stdout.split(" ")[-2] + "\n")
-            if float(process.stdout.split(" ")[-2]) > 4:
-                timeOutCounts += 1
-            if domain == data[2499]:
-                break
-
-
-def runCloudFareDNS():
-    timeOutCounts = 0
-    data = readDlist()
-    for _ in range(2):
-        for domain in data:
-            command = ['python3', 'Client.py', '1.1.1.1', '53', str(domain), 'A', '4']
-            process = subprocess.run(command, capture_output=True, text=True)
-            with open("performance/cloudfareDNSDomains.txt", 'a+') as f:
-                f.write(domain + "\n")
-            with open("performance/cloudfareDNSResolutionTimes.txt", 'a+') as f2:
-                f2.write(process.stdout.split(" ")[-2] + "\n")
-            if float(process.stdout.split(" ")[-2]) > 4:
-                timeOutCounts += 1
-            if domain == data[2499]:
-                break
-
-def testResolver():
-    dnsResolverCommand = ['python3', 'Resolver.py', '5600', '5']
-    dnsResolverProcess = subprocess.Popen(dnsResolverCommand) # Start resolver
-    timeOutCounts = 0
-    data = readDlist()
-    for _ in range(2):
-        for domain in data:
-            command = ['python3', 'Client.py', '127.0.0.1', '5600', str(domain), 'A', '4']
-            process = subprocess.run(command, capture_output=True, text=True)
-            print(process.stdout)
-            if float(process.stdout.split(" ")[-2]) > 4:
-                timeOutCounts += 1
-            if timeOutCounts > 3:
-                dnsResolverProcess.terminate()
-                dnsResolverProcess = subprocess.Popen(dnsResolverCommand) # restart resolver incase of overload on resolver or dns servers from too many queries.
-            if domain == data[2499]:
-                break
-
-if len(sys.argv) > 2:
-    print("Error: Invalid Arguments. Usage: python3 performanceRunner.py [type=1]")
-    print("Select 1 for Resolver.py, 2 for 8.8.8.8 Google DNS and 3 for 1.1.1.1 Cloudfare DNS")
-    exit()
-
-resolverType = 1
-if len(sys.argv) == 2:
-    resolverType = int(sys.argv[1])
+            if len(domain.strip()) > 0:
+                domainNames.append(domain.strip())
+    return domainNames[0:count] if count is not None else domainNames
 
-if __name__ == '__main__':
-    if resolverType == 1:
-        runClient()
-    elif resolverType == 2:
-        runGoogleDNS()
-    elif resolverType == 3:
-        runCloudFareDNS()
-    elif resolverType == 4:
-        testResolver()
+def resolverAddress(resolver, port):
+    if resolver == 'ours':
+        return ('127.0.0.1', port)
+    if resolver in RESOLVERS:
+        return RESOLVERS[resolver]
+    ip, separator, resolverPort = resolver.partition(':')
+    return (ip, int(resolverPort) if separator else 53)
+
+class PhaseResult:
+    # Outcome counts and latencies of one phase. Latencies are only recorded for queries
+    # that got a reply.
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = LatencyHistogram()
+        self.statuses = {}
+        self.duration = 0.0
 
+    def record(self, name, queryType, response, elapsed):
+        if response is None:
+            status = "TIMEOUT"
+        else:
+            status = rcodeTypes.get(response[3] & 0xF, str(response[3] & 0xF))
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if response is not None:
+            self.latency.record(elapsed)
+
+    def summary(self):
+        sent = sum(self.statuses.values())
+        result = {
+            "phase": self.name,
+            "sent": sent,
+            "answered": self.latency.count,
+            "timeouts": self.statuses.get("TIMEOUT", 0),
+            "rcodes": {status: count for status, count in self.statuses.items() if status != "TIMEOUT"},
+            "errors": sum([count for status, count in self.statuses.items() if status not in ("NOERROR", "NXDOMAIN")]),
+            "duration": round(self.duration, 4),
+            "qps": round(sent / self.duration, 1) if self.duration > 0 else 0,
+            "latencyMs": {},
+            "histogram": [[round(bound * 1000, 4) if bound is not None else None, count] for bound, count in self.latency.buckets()],
+        }
+        for fraction in PERCENTILES:
+            value = self.latency.percentile(fraction)
+            result["latencyMs"]["p" + format(fraction * 100, 'g')] = round(value * 1000, 3) if value is not None else None
+        if self.latency.count > 0:
+            result["latencyMs"]["mean"] = round(self.latency.sum / self.latency.count * 1000, 3)
+            result["latencyMs"]["max"] = round(self.latency.max * 1000, 3)
+        return result
+
+async def runPhase(name, address, domains, queryType, rate, concurrency, timeout):
+    phase = PhaseResult(name)
+    client = BatchClient(address, concurrency, timeout)
+    await client.open()
+    start = time.perf_counter()
+    try:
+        await client.run([(domain, queryType) for domain in domains], phase.record, rate)
+    finally:
+        client.close()
+    phase.duration = time.perf_counter() - start
+    return phase.summary()
+
+def runBenchmark(args):
+    domains = readDlist(args.names, args.count)
+    address = resolverAddress(args.resolver, args.port)
+    resolverProcess = None
+    if args.resolver == 'ours':
+        command = [sys.executable, 'Resolver.py', str(args.port), str(args.resolver_timeout)]
+        if args.root_hints is not None:
+            command += ['--root-hints', args.root_hints]
+        if args.upstream_port is not None:
+            command += ['--upstream-port', str(args.upstream_port)]
+        resolverProcess = subprocess.Popen(command)
+        time.sleep(RESOLVER_STARTUP)
+
+    phases = []
+    try:
+        for count in range(0, args.phases):
+            name = "cold" if count == 0 else "warm"
+            if count > 1:
+                name += str(count)
+            phases.append(asyncio.run(runPhase(name, address, domains, args.type, args.qps, args.concurrency, args.timeout)))
+            print(f"{name}: {phases[-1]['answered']}/{phases[-1]['sent']} answered, {phases[-1]['timeouts']} timeouts, "
+                f"latency ms {phases[-1]['latencyMs']}", file=sys.stderr)
+    finally:
+        if resolverProcess is not None:
+            resolverProcess.terminate()
+            resolverProcess.wait()
+
+    return {
+        "resolver": args.resolver,
+        "address": list(address),
+        "names": len(domains),
+        "type": args.type,
+        "qps": args.qps,
+        "concurrency": args.concurrency,
+        "timeout": args.timeout,
+        "started": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "phases": phases,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python3 performanceRunner.py [--resolver=ours|google|cloudflare|IP[:PORT]] [--qps=N] [--concurrency=100] [--output=FILE]")
+    parser.add_argument('--resolver', default='ours', help="ours starts Resolver.py, google and cloudflare use their public resolvers")
+    parser.add_argument('--port', type=int, default=5500, help="port to start Resolver.py on")
+    parser.add_argument('--resolver-timeout', type=float, default=5, help="timeout passed to Resolver.py")
+    parser.add_argument('--root-hints', default=None, help="root hints file passed to Resolver.py, e.g. mock.root written by mockHierarchy.py")
+    parser.add_argument('--upstream-port', type=int, default=None, help="upstream port passed to Resolver.py")
+    parser.add_argument('--names', default='dlist4000.txt', help="file of names to query")
+    parser.add_argument('--count', type=int, default=2500, help="number of names taken from the file")
+    parser.add_argument('--type', default='A')
+    parser.add_argument('--qps', type=float, default=None, help="queries per second, unpaced if not given")
+    parser.add_argument('--concurrency', type=int, default=100, help="maximum number of outstanding queries")
+    parser.add_argument('--timeout', type=float, default=4)
+    parser.add_argument('--phases', type=int, default=2, help="passes over the names, the first one cold")
+    parser.add_argument('--output', default=None, help="file to write the JSON report to instead of stdout")
+    args = parser.parse_args()
+    args.type = args.type.upper()
 
+    report = runBenchmark(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,222 @@
+import random
+import time
+from collections import OrderedDict, deque
+
+# Nameserver selection by smoothed round trip time, in the style of BIND and Unbound. Every
+# address the resolver talks to gets an SRTT and RTT variance, updated from observed
+# replies. Candidate addresses for a zone are tried fastest first, each query waits for a
+# retransmission timeout (RTO) computed from those estimates, and servers that keep failing
+# are held down for a while.
+
+# Weights of a new sample in the SRTT and RTT variance, as in RFC 6298 Section 2
+# (alpha = 1/8, beta = 1/4).
+SRTT_ALPHA = 0.125
+RTTVAR_BETA = 0.25
+
+# Addresses never queried get a random SRTT below this, so they are tried early once and
+# in a random order rather than always in file order (BIND does the same).
+UNKNOWN_SRTT = 0.032
+
+# RTO bounds. Unknown servers start at INITIAL_RTO (Unbound uses 376 ms), and every
+# consecutive timeout doubles the RTO (RFC 6298 Section 5.5) up to the resolver timeout.
+MIN_RTO = 0.05
+INITIAL_RTO = 0.4
+MAX_BACKOFF = 5
+
+# Ranking penalty charged for a timeout or a SERVFAIL/REFUSED reply. Penalties decay,
+# halving every PENALTY_HALF_LIFE seconds, so a server that failed once is retried after a
+# while instead of being avoided forever.
+TIMEOUT_PENALTY = 2.0
+FAILURE_PENALTY = 1.0
+PENALTY_HALF_LIFE = 60.0
+
+# After HOLDDOWN_FAILURES consecutive timeouts or SERVFAIL/REFUSED replies a server is held
+# down: it is only tried once every other candidate has been. The holddown doubles each
+# time it is renewed, up to MAX_HOLDDOWN (Unbound's infra-host-ttl).
+HOLDDOWN_FAILURES = 3
+HOLDDOWN_TIME = 30.0
+MAX_HOLDDOWN = 900.0
+
+# Fraction of rankings that put a random other candidate first, so servers that look slow
+# on old data keep being measured.
+EXPLORE_RATE = 0.05
+
+MAX_SERVERS = 10000
+
+# Hedging: if a server has not answered within the HEDGE_PERCENTILE of its recent round trip
+# times, the same question is also sent to the next best server. Percentiles come from the
+# last RTT_SAMPLES replies of the server, or of all servers while it has fewer than
+# MIN_SAMPLES, and are never below MIN_HEDGE_DELAY.
+HEDGE_PERCENTILE = 0.95
+RTT_SAMPLES = 32
+ALL_RTT_SAMPLES = 512
+MIN_SAMPLES = 8
+MIN_HEDGE_DELAY = 0.01
+
+# Hedged queries are capped at this fraction of primary queries, with up to HEDGE_BURST
+# saved up for bursts of slow servers.
+HEDGE_RATIO = 0.1
+HEDGE_BURST = 10.0
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+class ServerStats:
+    __slots__ = ('srtt', 'rttvar', 'samples', 'penalty', 'updated', 'backoff', 'failures', 'holddowns', 'holdUntil')
+
+    def __init__(self, now):
+        self.srtt = None
+        self.samples = deque(maxlen=RTT_SAMPLES)
+        self.rttvar = None
+        self.penalty = 0.0
+        self.updated = now
+        self.backoff = 0
+        self.failures = 0
+        self.holddowns = 0
+        self.holdUntil = 0.0
+
+    def decayedPenalty(self, now):
+        return self.penalty * 0.5 ** ((now - self.updated) / PENALTY_HALF_LIFE)
+
+class ServerSelector:
+
+    def __init__(self, maxTimeout, exploreRate=EXPLORE_RATE):
+        self.maxTimeout = maxTimeout
+        self.exploreRate = exploreRate
+        # address -> ServerStats, least recently updated first.
+        self.servers = OrderedDict()
+        self.samples = deque(maxlen=ALL_RTT_SAMPLES)
+
+    def srtt(self, address, now=None):
+        # Ranking key of address in seconds: the SRTT plus the decayed failure penalty, or
+        # None if the address was never queried.
+        stats = self.servers.get(address)
+        if stats is None:
+            return None
+        if now is None:
+            now = time.time()
+        return (stats.srtt if stats.srtt is not None else UNKNOWN_SRTT) + stats.decayedPenalty(now)
+
+    def rto(self, address):
+        # How long to wait for address before giving up on it, RFC 6298 Section 2.
+        stats = self.servers.get(address)
+        if stats is None or stats.srtt is None:
+            rto = INITIAL_RTO
+            backoff = stats.backoff if stats is not None else 0
+        else:
+            rto = stats.srtt + 4 * stats.rttvar
+            backoff = stats.backoff
+        return min(max(rto, MIN_RTO) * 2 ** backoff, self.maxTimeout)
+
+    def hedgeDelay(self, address):
+        # How long to wait for address before hedging the query to another server.
+        stats = self.servers.get(address)
+        if stats is not None and len(stats.samples) >= MIN_SAMPLES:
+            delay = percentile(stats.samples, HEDGE_PERCENTILE)
+        elif len(self.samples) >= MIN_SAMPLES:
+            delay = percentile(self.samples, HEDGE_PERCENTILE)
+        else:
+            delay = self.rto(address) / 2
+        return min(max(delay, MIN_HEDGE_DELAY), self.rto(address))
+
+    def isHeldDown(self, address, now=None):
+        stats = self.servers.get(address)
+        if stats is None:
+            return False
+        return stats.holdUntil > (now if now is not None else time.time())
+
+    def rank(self, addresses):
+        # Returns addresses ordered fastest first, held down servers last. Unknown addresses
+        # get a small random SRTT.
+        now = time.time()
+        keys = {}
+        for address in addresses:
+            srtt = self.srtt(address, now)
+            if srtt is None:
+                srtt = random.uniform(0, UNKNOWN_SRTT)
+            keys[address] = (self.isHeldDown(address, now), srtt)
+        ranked = sorted(set(addresses), key=keys.get)
+
+        if len(ranked) > 1 and random.random() < self.exploreRate:
+            candidate = random.randrange(1, len(ranked))
+            if not keys[ranked[candidate]][0]:
+                ranked.insert(0, ranked.pop(candidate))
+        return ranked
+
+    def recordRtt(self, address, rtt):
+        now = time.time()
+        stats = self.stats(address, now)
+        if stats.srtt is None:
+            stats.srtt = rtt
+            stats.rttvar = rtt / 2
+        else:
+            stats.rttvar += RTTVAR_BETA * (abs(stats.srtt - rtt) - stats.rttvar)
+            stats.srtt += SRTT_ALPHA * (rtt - stats.srtt)
+        stats.samples.append(rtt)
+        self.samples.append(rtt)
+        stats.penalty = stats.decayedPenalty(now)
+        stats.updated = now
+        stats.backoff = 0
+
+    def recordSuccess(self, address):
+        # A usable reply (anything but SERVFAIL or REFUSED) ends any holddown.
+        stats = self.servers.get(address)
+        if stats is not None:
+            stats.failures = 0
+            stats.holddowns = 0
+            stats.holdUntil = 0.0
+
+    def recordTimeout(self, address):
+        # Counts towards a holddown and doubles the next RTO.
+        now = time.time()
+        stats = self.stats(address, now)
+        stats.backoff = min(stats.backoff + 1, MAX_BACKOFF)
+        self.fail(stats, TIMEOUT_PENALTY, now)
+
+    def recordFailure(self, address):
+        # A SERVFAIL or REFUSED reply: the server is up but can not answer for the zone.
+        now = time.time()
+        self.fail(self.stats(address, now), FAILURE_PENALTY, now)
+
+    def fail(self, stats, penalty, now):
+        stats.penalty = stats.decayedPenalty(now) + penalty
+        stats.updated = now
+        stats.failures += 1
+        if stats.failures >= HOLDDOWN_FAILURES:
+            stats.holdUntil = now + min(HOLDDOWN_TIME * 2 ** stats.holddowns, MAX_HOLDDOWN)
+            stats.holddowns += 1
+            stats.failures = 0
+
+    def stats(self, address, now):
+        stats = self.servers.pop(address, None)
+        if stats is None:
+            stats = ServerStats(now)
+        self.servers[address] = stats
+        while len(self.servers) > MAX_SERVERS:
+            self.servers.popitem(last=False)
+        return stats
+
+class HedgeBudget:
+    # Token bucket limiting hedged queries to a fraction of primary queries.
+
+    def __init__(self, ratio=HEDGE_RATIO, burst=HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst if ratio > 0 else 0.0
+        self.primaries = 0
+        self.hedges = 0
+
+    def addQuery(self):
+        self.primaries += 1
+        self.tokens = min(self.tokens + self.ratio, self.burst)
+
+    def available(self):
+        return self.tokens >= 1
+
+    def take(self):
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.hedges += 1
+        return True
@@ -0,0 +1,120 @@
+import hashlib
+import mmap
+import multiprocessing
+import struct
+from cache import CacheEntry
+from encoder import sharedEncoder
+from message import parseMessage
+
+# Answer cache shared by the worker processes of a multi-core resolver. It lives in an
+# anonymous shared mmap created before the workers are forked, so an answer resolved by one
+# worker is a hit for all of them. Each worker keeps its own AnswerCache in front of it.
+#
+# The map is an array of fixed size slots grouped into buckets of BUCKET_WAYS slots. A key
+# hashes to one bucket, and a new entry replaces a slot holding the same key, an empty or
+# expired slot, or else the slot that expires soonest. A slot holds a header followed by
+# the entry encoded as a DNS message whose question is the key (qtype 0 for an NXDOMAIN
+# entry), which doubles as a check against hash collisions.
+#
+# Writers take one of LOCK_STRIPES locks. Readers take no lock: every slot has a sequence
+# number that is odd while the slot is being written, and a reader that sees it odd or
+# changed while copying the slot treats the lookup as a miss.
+
+SLOT_SIZE = 1024
+BUCKET_WAYS = 4
+LOCK_STRIPES = 64
+SHARED_CACHE_MB = 64
+
+# Sequence number, key hash, time stored, time expires, negative, message length.
+SLOT_HEADER = struct.Struct('=IQddBHx')
+SEQUENCE = struct.Struct('=I')
+
+def hashKey(key):
+    # Hash of a cache key that is the same in every process, unlike hash().
+    qname, qtype, qclassInfo = key
+    keyBytes = qname.encode() + struct.pack('!HH', qtype or 0, qclassInfo)
+    return int.from_bytes(hashlib.blake2b(keyBytes, digest_size=8).digest(), 'little')
+
+def encodeEntry(key, entry):
+    sharedEncoder.begin(0, entry.flags)
+    sharedEncoder.addQuestion(key[0], key[1] or 0, key[2])
+    for section, records in ((1, entry.answers), (2, entry.authority), (3, entry.additional)):
+        for record in records:
+            sharedEncoder.addRecord(section, record, record.ttl)
+    return sharedEncoder.finish()
+
+class SharedAnswerStore:
+
+    def __init__(self, sizeMb=SHARED_CACHE_MB):
+        self.buckets = max(sizeMb * 1024 * 1024 // (SLOT_SIZE * BUCKET_WAYS), 1)
+        # Anonymous maps are MAP_SHARED, so forked workers all see the same pages.
+        self.map = mmap.mmap(-1, self.buckets * BUCKET_WAYS * SLOT_SIZE)
+        self.locks = [multiprocessing.Lock() for count in range(0, LOCK_STRIPES)]
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def slots(self, keyHash):
+        first = (keyHash % self.buckets) * BUCKET_WAYS
+        return range(first, first + BUCKET_WAYS)
+
+    def load(self, key, now):
+        # Returns the CacheEntry stored for key, or None.
+        keyHash = hashKey(key)
+        for slot in self.slots(keyHash):
+            offset = slot * SLOT_SIZE
+            sequence, slotHash, stored, expires, negative, length = SLOT_HEADER.unpack_from(self.map, offset)
+            if slotHash != keyHash or sequence & 1 or length == 0 or expires <= now:
+                continue
+            data = self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+            if SEQUENCE.unpack_from(self.map, offset)[0] != sequence:
+                break # Rewritten while being copied.
+            try:
+                message = parseMessage(data)
+                if len(message.questions) != 1 or message.qname != key[0] or message.questions[0][1] != (key[1] or 0) or message.questions[0][2] != key[2]:
+                    continue
+                self.hits += 1
+                return CacheEntry(message, stored, expires, negative == 1)
+            except ValueError:
+                continue
+        self.misses += 1
+        return None
+
+    def save(self, key, entry, now):
+        try:
+            data = encodeEntry(key, entry)
+        except ValueError:
+            return
+        if len(data) > SLOT_SIZE - SLOT_HEADER.size:
+            return # Too large to share, stays in the worker's own cache.
+
+        keyHash = hashKey(key)
+        victim = None
+        victimExpires = None
+        for slot in self.slots(keyHash):
+            sequence, slotHash, stored, expires, negative, length = SLOT_HEADER.unpack_from(self.map, slot * SLOT_SIZE)
+            if slotHash == keyHash or length == 0 or expires <= now:
+                victim = slot
+                break
+            if victimExpires is None or expires < victimExpires:
+                victim = slot
+                victimExpires = expires
+
+        offset = victim * SLOT_SIZE
+        with self.locks[victim % LOCK_STRIPES]:
+            # The sequence number is odd from before the first byte changes until after the
+            # last one has, and is only made even again once the whole slot is written.
+            sequence = SEQUENCE.unpack_from(self.map, offset)[0]
+            SEQUENCE.pack_into(self.map, offset, (sequence + 1) & 0xFFFFFFFF)
+            self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+            SLOT_HEADER.pack_into(self.map, offset, (sequence + 1) & 0xFFFFFFFF, keyHash, entry.stored,
+                entry.expires, 1 if entry.negative else 0, len(data))
+            SEQUENCE.pack_into(self.map, offset, (sequence + 2) & 0xFFFFFFFF)
+        self.stores += 1
+
+    def stats(self):
+        return {
+            "sharedHits": self.hits,
+            "sharedMisses": self.misses,
+            "sharedStores": self.stores,
+        }
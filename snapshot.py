@@ -0,0 +1,182 @@
+import mmap
+import os
+import socket
+import struct
+import time
+from cache import CacheEntry, ANY_TYPE
+from message import parseMessage
+from sharedCache import encodeEntry
+
+# On disk snapshot of the answer and delegation caches, so a restarted resolver starts warm.
+# Entries keep their absolute store and expiry times, so whatever TTL they had left when the
+# snapshot was written, minus the time the resolver was down, carries over.
+#
+# Layout, all integers in native byte order:
+#
+#   header       magic, version, time written, number of answers and delegations, offsets
+#                of the index and delegation sections
+#   answers      per entry: stored, expires, negative, length, entry encoded as a DNS message
+#                (see sharedCache.encodeEntry)
+#   index        per entry: qtype (0 for an NXDOMAIN entry), qclass, offset of the entry,
+#                length and bytes of the qname
+#   delegations  per zone: zone name, expiry, NS names, IPv4 addresses
+#
+# A snapshot is mapped rather than read: loading only builds a dictionary from the index,
+# and an answer is decoded the first time it is looked up. Entries that have expired by then
+# are dropped instead.
+
+MAGIC = b'DNSSNAP1'
+VERSION = 2
+
+HEADER = struct.Struct('=8sHdIIQQ')
+ANSWER = struct.Struct('=ddBH')
+INDEX = struct.Struct('=HHQH')
+DELEGATION = struct.Struct('=dHH')
+
+# Seconds between snapshots written while the resolver runs.
+SNAPSHOT_INTERVAL = 300
+
+# Names are stored with a 16 bit length: readName turns octets outside ASCII into \xNN
+# escapes of four characters each, so the text of a valid name can be longer than 255.
+NAME_LENGTH = struct.Struct('=H')
+
+def packName(name):
+    data = name.encode()
+    return NAME_LENGTH.pack(len(data)) + data
+
+def unpackName(data, offset):
+    length = NAME_LENGTH.unpack_from(data, offset)[0]
+    offset += NAME_LENGTH.size
+    return (bytes(data[offset:offset + length]).decode(), offset + length)
+
+class Snapshot:
+    # A snapshot file mapped into memory, answering lookups for the entries it holds.
+
+    def __init__(self, fileName):
+        self.file = open(fileName, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError("empty snapshot")
+        try:
+            magic, version, self.written, answerCount, delegationCount, indexOffset, delegationOffset = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("not a snapshot of this version")
+
+            # (qname, qtype, qclass) -> offset of the entry, for entries not looked up yet.
+            self.index = {}
+            offset = indexOffset
+            for count in range(0, answerCount):
+                qtype, qclassInfo, entryOffset, nameLength = INDEX.unpack_from(self.map, offset)
+                offset += INDEX.size
+                qname = bytes(self.map[offset:offset + nameLength]).decode()
+                offset += nameLength
+                self.index[(qname, qtype if qtype != 0 else ANY_TYPE, qclassInfo)] = entryOffset
+
+            # (zone, nsNames, addresses, expires) of every delegation.
+            self.delegations = []
+            offset = delegationOffset
+            for count in range(0, delegationCount):
+                zone, offset = unpackName(self.map, offset)
+                expires, nsCount, addressCount = DELEGATION.unpack_from(self.map, offset)
+                offset += DELEGATION.size
+                nsNames = []
+                for nameCount in range(0, nsCount):
+                    nsName, offset = unpackName(self.map, offset)
+                    nsNames.append(nsName)
+                addresses = [socket.inet_ntoa(self.map[offset + 4 * index:offset + 4 * index + 4]) for index in range(0, addressCount)]
+                offset += 4 * addressCount
+                self.delegations.append((zone, nsNames, addresses, expires))
+        except (struct.error, IndexError, OverflowError, UnicodeDecodeError) as error:
+            self.close()
+            raise ValueError(f"corrupt snapshot: {error}")
+        except ValueError:
+            self.close()
+            raise
+
+    def load(self, key):
+        # Returns the CacheEntry stored for key and forgets it, or None. Every entry is only
+        # handed out once, the cache keeps it from then on.
+        offset = self.index.pop(key, None)
+        if offset is None:
+            return None
+        try:
+            stored, expires, negative, length = ANSWER.unpack_from(self.map, offset)
+            start = offset + ANSWER.size
+            return CacheEntry(parseMessage(self.map[start:start + length]), stored, expires, negative == 1)
+        except (ValueError, OverflowError, struct.error):
+            return None
+
+    def rawEntries(self):
+        # (key, bytes of the entry) of every entry not looked up yet, to carry them over into
+        # the next snapshot without decoding them.
+        for key, offset in self.index.items():
+            length = ANSWER.unpack_from(self.map, offset)[3]
+            yield (key, self.map[offset:offset + ANSWER.size + length])
+
+    def close(self):
+        self.index = {}
+        self.map.close()
+        self.file.close()
+
+def loadSnapshot(fileName):
+    # Maps the snapshot at fileName, or returns None if there is none.
+    if not os.path.exists(fileName):
+        return None
+    return Snapshot(fileName)
+
+def saveSnapshot(fileName, answerCache, delegationCache):
+    # Writes both caches to fileName, replacing it atomically. Entries past any use, even
+    # stale, are left out.
+    now = time.time()
+    answers = bytearray(HEADER.size)
+    index = bytearray()
+    count = 0
+
+    def addEntry(key, data):
+        index.extend(INDEX.pack(key[1] or 0, key[2], len(answers), len(key[0].encode())) + key[0].encode())
+        answers.extend(data)
+
+    for key, entry in answerCache.entries.items():
+        if entry.expires + answerCache.maxStale <= now:
+            continue
+        try:
+            message = encodeEntry(key, entry)
+        except ValueError:
+            continue
+        addEntry(key, ANSWER.pack(entry.stored, entry.expires, 1 if entry.negative else 0, len(message)) + message)
+        count += 1
+    if answerCache.snapshot is not None:
+        for key, data in answerCache.snapshot.rawEntries():
+            if key not in answerCache.entries and ANSWER.unpack_from(data, 0)[1] + answerCache.maxStale > now:
+                addEntry(key, data)
+                count += 1
+
+    delegations = bytearray()
+    delegationCount = 0
+    for zone, delegation in delegationCache.zones.items():
+        if delegation.expires <= now:
+            continue
+        delegations.extend(packName(zone) + DELEGATION.pack(delegation.expires, len(delegation.nsNames), len(delegation.addresses)))
+        for nsName in delegation.nsNames:
+            delegations.extend(packName(nsName))
+        for address in delegation.addresses:
+            delegations.extend(socket.inet_aton(address))
+        delegationCount += 1
+
+    indexOffset = len(answers)
+    HEADER.pack_into(answers, 0, MAGIC, VERSION, now, count, delegationCount, indexOffset, indexOffset + len(index))
+    temporary = fileName + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(answers)
+        f.write(index)
+        f.write(delegations)
+    os.replace(temporary, fileName)
+    return count
+
+def restoreDelegations(snapshot, delegationCache):
+    now = time.time()
+    for zone, nsNames, addresses, expires in snapshot.delegations:
+        if expires > now:
+            delegationCache.put(zone, nsNames, addresses, expires - now)
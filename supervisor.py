@@ -0,0 +1,75 @@
+import os
+import signal
+import sys
+import time
+
+# Runs the resolver as several worker processes, one per core. Each worker binds its own
+# socket to the resolver port with SO_REUSEPORT and the kernel spreads client queries
+# across them. The supervisor only forks the workers, restarts any that die, and passes
+# SIGTERM and SIGINT on to them.
+
+# A worker that dies within RESTART_WINDOW seconds of starting is restarted after
+# RESTART_DELAY seconds instead of at once, so a worker that can not start does not spin.
+RESTART_WINDOW = 1.0
+RESTART_DELAY = 1.0
+
+def startWorker(runWorker, index):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # Worker process: restore the default handlers replaced by the supervisor, run, and
+    # never return into the supervisor's code.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    status = 0
+    try:
+        runWorker(index)
+    except KeyboardInterrupt:
+        pass
+    except BaseException as error:
+        print(f"Worker {index} failed: {error!r}", file=sys.stderr)
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(status)
+
+def runSupervisor(workers, runWorker):
+    # Forks `workers` processes calling runWorker(index) and keeps that many running until
+    # SIGTERM or SIGINT, which are forwarded to every worker before waiting for them to exit.
+    children = {} # pid -> (worker index, time started)
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(0, workers):
+        children[startWorker(runWorker, index)] = (index, time.monotonic())
+
+    while len(children) > 0:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid)
+        if len(stopping) > 0:
+            continue
+
+        if os.WIFSIGNALED(status):
+            reason = f"killed by signal {os.WTERMSIG(status)}"
+        else:
+            reason = f"exited with status {os.WEXITSTATUS(status)}"
+        print(f"Worker {index} (pid {pid}) {reason}, restarting", file=sys.stderr)
+        if time.monotonic() - started < RESTART_WINDOW:
+            time.sleep(RESTART_DELAY)
+        if len(stopping) == 0:
+            children[startWorker(runWorker, index)] = (index, time.monotonic())
@@ -0,0 +1,47 @@
+import asyncio
+import unittest
+from admission import AdmissionControl
+
+class AdmissionTest(unittest.IsolatedAsyncioTestCase):
+
+    async def testShedWithoutQueue(self):
+        admission = AdmissionControl(maxActive=1, maxQueued=0)
+        self.assertTrue(await admission.acquire('a'))
+        self.assertFalse(await admission.acquire('b'))
+        self.assertEqual(admission.stats()['shed'], 1)
+
+    async def testFullQueuePushesOutLongest(self):
+        admission = AdmissionControl(maxActive=1, maxQueued=2)
+        self.assertTrue(await admission.acquire('flood'))
+        waiting = [asyncio.ensure_future(admission.acquire('flood')) for count in range(0, 2)]
+        await asyncio.sleep(0)
+        light = asyncio.ensure_future(admission.acquire('light'))
+        for count in range(0, 3):
+            await asyncio.sleep(0)
+        # The newest query of the flooding client made room for the light one.
+        self.assertTrue(waiting[1].done())
+        self.assertFalse(waiting[1].result())
+
+        admission.release()
+        self.assertTrue(await waiting[0])
+        admission.release()
+        self.assertTrue(await light)
+        self.assertEqual(admission.stats()['queued'], 0)
+
+    async def testExpiredQueriesNotStarted(self):
+        admission = AdmissionControl(maxActive=1, maxQueued=10, maxWait=0.01)
+        self.assertTrue(await admission.acquire('a'))
+        waiting = asyncio.ensure_future(admission.acquire('b'))
+        await asyncio.sleep(0.05)
+        admission.release()
+        self.assertFalse(await waiting)
+        self.assertEqual(admission.stats()['expired'], 1)
+        self.assertEqual(admission.active, 0)
+
+    async def testLowPriorityYields(self):
+        admission = AdmissionControl(maxActive=2, maxQueued=10, lowPriorityShare=0.5)
+        self.assertTrue(admission.tryAcquireLowPriority())
+        self.assertFalse(admission.tryAcquireLowPriority())
+
+if __name__ == '__main__':
+    unittest.main()
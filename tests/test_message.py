@@ -0,0 +1,88 @@
+import json
+import struct
+import unittest
+from encoder import MessageEncoder, createQuery, QR
+from message import parseMessage, readName, nameToWire
+from mockHierarchy import makeRecord, aRecord
+from batchClient import resultRecord
+from upstream import UpstreamProtocol
+
+# Parser, encoder and presentation of records, on hand built messages.
+
+def message(answers, flags=QR):
+    # A reply to "example.com. A" with the given answer records as raw wire bytes.
+    query = createQuery(1, 'example.com')
+    header = struct.pack('!HHHHHH', 1, flags, 1, len(answers), 0, 0)
+    return header + query[12:] + b''.join(answers)
+
+class ParserTest(unittest.TestCase):
+
+    def testPointerLoopRejected(self):
+        # An owner name pointing at itself, which parseMessage skips without following.
+        record = b'\xc0\x1d' + struct.pack('!HHLH', 1, 1, 300, 4) + b'\x0a\x00\x00\x01'
+        reply = parseMessage(message([record]))
+        self.assertRaises(ValueError, lambda: reply.answers[0].name)
+        self.assertRaises(ValueError, reply.check)
+
+    def testForwardPointerRejected(self):
+        data = b'\x00' * 12 + b'\xc0\x10\x00\x00' + b'\x03www\x00'
+        self.assertRaises(ValueError, readName, data, 12)
+
+    def testRdataPastLength(self):
+        record = b'\xc0\x0c' + struct.pack('!HHLH', 1, 1, 300, 3) + b'\x0a\x00\x00'
+        self.assertRaises(ValueError, parseMessage(message([record])).check)
+
+    def testRdataNamesChecked(self):
+        record = b'\xc0\x0c' + struct.pack('!HHLH', 5, 1, 300, 2) + b'\xc0\xff'
+        self.assertRaises(ValueError, parseMessage(message([record])).check)
+
+    def testValidMessageChecks(self):
+        record = b'\xc0\x0c' + struct.pack('!HHLH', 5, 1, 300, 2) + b'\xc0\x0c'
+        reply = parseMessage(message([record]))
+        reply.check()
+        self.assertEqual(reply.answers[0].target(), 'example.com.')
+
+class EncoderTest(unittest.TestCase):
+
+    def testNameCompression(self):
+        records = [aRecord('www.example.com.', '10.0.0.1'),
+            makeRecord('mail.example.com.', 5, 300, nameToWire('www.example.com.'))]
+        encoder = MessageEncoder()
+        encoder.begin(1, QR)
+        encoder.addQuestion('example.com.', 1, 1)
+        for record in records:
+            encoder.addRecord(1, record, 300)
+        data = encoder.finish()
+
+        uncompressed = len(message([])) + sum([len(record.buffer) + 10 for record in records])
+        self.assertLess(len(data), uncompressed)
+        reply = parseMessage(data)
+        reply.check()
+        self.assertEqual([record.name for record in reply.answers], ['www.example.com.', 'mail.example.com.'])
+        self.assertEqual(reply.answers[0].address(), '10.0.0.1')
+        self.assertEqual(reply.answers[1].target(), 'www.example.com.')
+
+    def testDetachExpandsNames(self):
+        record = b'\xc0\x0c' + struct.pack('!HHLH', 5, 1, 300, 6) + b'\x03www\xc0\x0c'
+        detached = parseMessage(message([record])).answers[0].detach()
+        self.assertEqual(detached.name, 'example.com.')
+        self.assertEqual(detached.target(), 'www.example.com.')
+
+class PresentationTest(unittest.TestCase):
+
+    def testTextAndUnknownRdataSerializable(self):
+        text = b'\xc0\x0c' + struct.pack('!HHLH', 16, 1, 300, 9) + b'\x03a"c\x04d\xffef'
+        null = b'\xc0\x0c' + struct.pack('!HHLH', 10, 1, 300, 2) + b'\x01\x02'
+        result = resultRecord('example.com', 'TXT', message([text, null]), 0.1)
+        json.dumps(result)
+        self.assertEqual([answer["data"] for answer in result["answers"]], ['"a\\"c" "d\\xffef"', '\\# 2 0102'])
+
+class UpstreamTest(unittest.TestCase):
+
+    def testGarbageDatagramIgnored(self):
+        protocol = UpstreamProtocol()
+        protocol.datagram_received(b'\x00' * 12 + b'\xc0', ('127.0.0.1', 53))
+        protocol.datagram_received(b'\x00' * 12, ('127.0.0.1', 53))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import struct
+import unittest
+from encoder import MessageEncoder, createQuery, QR, AA
+from message import parseMessage, nameToWire
+from helpers import questionBytes
+from cache import ANY_TYPE
+from admission import AdmissionControl
+from mockHierarchy import Hierarchy, makeRecord, aRecord, syntheticAddress
+from Resolver import Resolver, formatError
+
+# The resolver walking a mock hierarchy in process, without sockets: HierarchyUpstream hands
+# every upstream query straight to Hierarchy.answer. Servers can be made to forge replies.
+
+class HierarchyUpstream:
+    # Stands in for upstream.UpstreamTransport.
+
+    def __init__(self, hierarchy, forge=None):
+        self.hierarchy = hierarchy
+        # Function of (server, query) returning the reply to send instead of the real one,
+        # or None to answer truthfully.
+        self.forge = forge
+        self.queries = 0
+        self.noEdns = set()
+        self.tcpQueries = 0
+        self.rotations = 0
+
+    async def query(self, query, server, timeout):
+        self.queries += 1
+        if self.forge is not None:
+            forged = self.forge(server, query)
+            if forged is not None:
+                return forged
+        return self.hierarchy.answer(server, query)
+
+    async def queryTcp(self, query, server, timeout):
+        return await self.query(query, server, timeout)
+
+def forgedReply(query, rcode, answers, authority):
+    # Authoritative reply to query holding the given mockHierarchy records.
+    encoder = MessageEncoder()
+    encoder.begin(struct.unpack('!H', query[0:2])[0], QR | AA | rcode)
+    encoder.addRawQuestion(query[12:12 + len(questionBytes(query))])
+    for section, records in ((1, answers), (2, authority)):
+        for record in records:
+            encoder.addRecord(section, record, record.ttl)
+    return encoder.finish()
+
+def cname(name, target):
+    return makeRecord(name, 5, 300, nameToWire(target))
+
+class ResolverTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.hierarchy = Hierarchy(['example.com', 'bank.com', 'evil.com'], leafServers=4)
+        self.example = self.hierarchy.zones['example.com.']
+        self.evil = self.hierarchy.zones['evil.com.']
+
+    def makeResolver(self, forge=None, admission=None):
+        roots = [self.hierarchy.hosts[nsName] for nsName in self.hierarchy.zones['.'].nsNames]
+        resolver = Resolver(roots, 1.0, prefetch=False, admission=admission)
+        resolver.upstream = resolver.glueUpstream = HierarchyUpstream(self.hierarchy, forge)
+        return resolver
+
+    def forgeFor(self, zone, name, reply):
+        # The servers of zone answer questions about name with reply(query).
+        def forge(server, query):
+            if zone in self.hierarchy.servers.get(server, []) and parseMessage(query).qname == name:
+                return reply(query)
+            return None
+        return forge
+
+    async def ask(self, resolver, name, qtype=1):
+        response = await resolver.resolve(createQuery(qtype, name), client='127.0.0.1')
+        return parseMessage(response)
+
+    async def testAnswerCached(self):
+        resolver = self.makeResolver()
+        reply = await self.ask(resolver, 'www.example.com')
+        self.assertEqual(reply.rcode, 0)
+        self.assertEqual(reply.answers[0].address(), syntheticAddress('www.example.com.'))
+        queries = resolver.upstream.queries
+        await self.ask(resolver, 'www.example.com')
+        self.assertEqual(resolver.upstream.queries, queries)
+
+    async def testNegativeAnswerCached(self):
+        resolver = self.makeResolver()
+        self.assertEqual((await self.ask(resolver, 'gone.example.com')).rcode, 3)
+        entry = resolver.answerCache.get(('gone.example.com.', 28, 1))
+        self.assertTrue(entry[0].negative)
+        queries = resolver.upstream.queries
+        self.assertEqual((await self.ask(resolver, 'gone.example.com', 15)).rcode, 3)
+        self.assertEqual(resolver.upstream.queries, queries)
+
+    async def testCnameChainFollowed(self):
+        self.example.add(cname('alias.example.com.', 'www.bank.com.'))
+        resolver = self.makeResolver()
+        reply = await self.ask(resolver, 'alias.example.com')
+        self.assertEqual(reply.rcode, 0)
+        self.assertEqual([(record.name, record.rtype) for record in reply.answers],
+            [('alias.example.com.', 5), ('www.bank.com.', 1)])
+        self.assertIsNotNone(resolver.answerCache.get(('alias.example.com.', 1, 1)))
+        self.assertIsNotNone(resolver.answerCache.get(('www.bank.com.', 1, 1)))
+
+    async def testCnameLoop(self):
+        self.example.add(cname('one.example.com.', 'two.example.com.'))
+        self.example.add(cname('two.example.com.', 'one.example.com.'))
+        resolver = self.makeResolver()
+        self.assertEqual((await self.ask(resolver, 'one.example.com')).rcode, 2)
+
+    async def testNxdomainAfterCnameCachedForTarget(self):
+        soa = self.example.soa
+        forge = self.forgeFor('example.com.', 'alias.example.com.', lambda query: forgedReply(query, 3,
+            [cname('alias.example.com.', 'missing.example.com.')], [soa]))
+        resolver = self.makeResolver(forge)
+        reply = await self.ask(resolver, 'alias.example.com')
+        self.assertEqual(reply.rcode, 3)
+        self.assertEqual(len(reply.answers), 1)
+        self.assertFalse(resolver.answerCache.get(('alias.example.com.', 1, 1))[0].negative)
+        self.assertTrue(resolver.answerCache.get(('missing.example.com.', 1, 1))[0].negative)
+
+    async def testForeignNxdomainNotCached(self):
+        soa = self.evil.soa
+        forge = self.forgeFor('evil.com.', 'www.evil.com.', lambda query: forgedReply(query, 3,
+            [cname('www.evil.com.', 'www.bank.com.')], [soa]))
+        resolver = self.makeResolver(forge)
+        reply = await self.ask(resolver, 'www.evil.com')
+        self.assertEqual(reply.rcode, 0)
+        self.assertEqual(reply.answers[-1].address(), syntheticAddress('www.bank.com.'))
+        entry = resolver.answerCache.get(('www.bank.com.', 28, 1))
+        self.assertTrue(entry is None or not entry[0].negative)
+
+    async def testForeignRecordsDropped(self):
+        forge = self.forgeFor('evil.com.', 'www.evil.com.', lambda query: forgedReply(query, 0,
+            [cname('www.evil.com.', 'www.bank.com.'), aRecord('www.bank.com.', '6.6.6.6')], []))
+        resolver = self.makeResolver(forge)
+        reply = await self.ask(resolver, 'www.evil.com')
+        addresses = [record.address() for record in reply.answers if record.rtype == 1]
+        self.assertEqual(addresses, [syntheticAddress('www.bank.com.')])
+        cached = resolver.answerCache.get(('www.bank.com.', 1, 1))
+        self.assertEqual(cached[0].answers[0].address(), syntheticAddress('www.bank.com.'))
+
+    async def testMalformedReplyFailsServerOnly(self):
+        # A CNAME whose target is a compression pointer loop, from every server for evil.com.
+        def malformed(query):
+            reply = bytearray(forgedReply(query, 0, [cname('www.evil.com.', 'www.bank.com.')], []))
+            reply[-2:] = struct.pack('!H', 0xC000 | (len(reply) - 2))
+            return bytes(reply)
+        resolver = self.makeResolver(self.forgeFor('evil.com.', 'www.evil.com.', malformed))
+        self.assertEqual(await resolver.resolve(createQuery(1, 'www.evil.com'), client='127.0.0.1'), b'timeout')
+        self.assertEqual((await self.ask(resolver, 'www.bank.com')).rcode, 0)
+
+    async def testOverloadShed(self):
+        admission = AdmissionControl(maxActive=1, maxQueued=0)
+        resolver = self.makeResolver(admission=admission)
+        self.assertTrue(await admission.acquire('other'))
+        self.assertEqual((await self.ask(resolver, 'www.example.com')).rcode, 2)
+        admission.release()
+        self.assertEqual((await self.ask(resolver, 'www.example.com')).rcode, 0)
+
+    async def testMalformedQueryFormerr(self):
+        resolver = self.makeResolver()
+        query = createQuery(1, 'www.example.com')
+        query = query[0:12] + b'\xc0\x0c' + query[-4:]
+        with self.assertRaises(ValueError):
+            await resolver.resolve(query, client='127.0.0.1')
+        self.assertEqual(formatError(query)[3] & 0xF, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import struct
+import tempfile
+import unittest
+from encoder import MessageEncoder, createQuery, QR
+from message import parseMessage, readName
+from cache import AnswerCache, DelegationCache, ANY_TYPE
+from mockHierarchy import aRecord, Zone
+from snapshot import saveSnapshot, loadSnapshot, restoreDelegations
+
+def reply(name, flags, answers, authority):
+    # Reply to "name A" holding answers and authority, ResourceRecords of mockHierarchy.
+    encoder = MessageEncoder()
+    encoder.begin(1, QR | flags)
+    encoder.addQuestion(name, 1, 1)
+    for section, records in ((1, answers), (2, authority)):
+        for record in records:
+            encoder.addRecord(section, record, record.ttl)
+    return parseMessage(encoder.finish())
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.fileName = os.path.join(directory.name, 'snapshot')
+        self.soa = Zone('example.com.', ['ns1.example.com.']).soa
+
+    def testRoundTrip(self):
+        answerCache = AnswerCache()
+        answerCache.put(('www.example.com.', 1, 1), reply('www.example.com.', 0, [aRecord('www.example.com.', '10.0.0.1')], []), 300)
+        answerCache.putNegative(('gone.example.com.', ANY_TYPE, 1), reply('gone.example.com.', 3, [], [self.soa]), 300)
+        delegationCache = DelegationCache()
+        delegationCache.put('example.com.', ['ns1.example.com.'], ['10.0.0.53'], 300)
+        self.assertEqual(saveSnapshot(self.fileName, answerCache, delegationCache), 2)
+
+        snapshot = loadSnapshot(self.fileName)
+        self.addCleanup(snapshot.close)
+        entry = snapshot.load(('www.example.com.', 1, 1))
+        self.assertEqual(entry.answers[0].address(), '10.0.0.1')
+        negative = snapshot.load(('gone.example.com.', ANY_TYPE, 1))
+        self.assertTrue(negative.negative)
+        self.assertEqual(negative.flags & 0xF, 3)
+        restored = DelegationCache()
+        restoreDelegations(snapshot, restored)
+        self.assertEqual(restored.findClosest('www.example.com.')[0], 'example.com.')
+
+    def testLongEscapedName(self):
+        # Octets outside ASCII are read as four character escapes, which makes the key of
+        # this 225 octet name 854 characters long.
+        wire = b''.join([b'\x0f' + b'\xff' * 15 for count in range(0, 14)]) + b'\x00'
+        name = readName(wire, 0)[0]
+        self.assertGreater(len(name), 255)
+        query = createQuery(1, 'example.com')
+        data = query[0:2] + struct.pack('!HHHHH', QR | 3, 1, 0, 0, 0) + wire + b'\x00\x01\x00\x01'
+        answerCache = AnswerCache()
+        answerCache.putNegative((name, ANY_TYPE, 1), parseMessage(data), 300)
+        self.assertEqual(saveSnapshot(self.fileName, answerCache, DelegationCache()), 1)
+        snapshot = loadSnapshot(self.fileName)
+        self.addCleanup(snapshot.close)
+        self.assertIsNotNone(snapshot.load((name, ANY_TYPE, 1)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import asyncio
+import random
+import socket
+import struct
+from helpers import questionBytes
+from message import parseMessage
+from encoder import sharedEncoder, randomId, RD, EDNS_PAYLOAD
+from connectionPool import ConnectionPool
+
+# Port authoritative servers listen on, as specified by RFC 1035 Section 4.2.
+DNS_PORT = 53
+
+# Number of UDP sockets upstream queries are spread over. Each socket has its own
+# ephemeral source port, which adds to the entropy a spoofed reply has to guess. A socket
+# is replaced by one on a new port after ROTATE_QUERIES queries, so its port can not be
+# learned from earlier queries and then used for long (RFC 5452 Section 9.2).
+UPSTREAM_SOCKETS = 4
+ROTATE_QUERIES = 500
+
+# Sockets and transaction IDs are picked with the operating system's random source, the
+# Mersenne Twister of random can be predicted from its outputs.
+systemRandom = random.SystemRandom()
+
+# RCODEs of a server rejecting a query because of its OPT record, FORMERR and NOTIMP.
+NO_EDNS_RCODES = (1, 4)
+
+class UpstreamProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self):
+        self.transport = None
+        # Outstanding queries on this socket, keyed by
+        # (transaction ID, server ip, server port, question section).
+        self.pending = {}
+        self.sent = 0
+        # Replaced by a socket on a new port, closed once its outstanding queries are done.
+        self.retired = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if len(data) < 12:
+            return
+        queryId = struct.unpack('!H', data[0:2])[0]
+
+        # Replies are demultiplexed by transaction ID, the server they came from, the
+        # socket (source port) they arrived on and the question they echo back, as
+        # recommended by RFC 5452 Section 9.1. Anything else is dropped.
+        try:
+            key = (queryId, address[0], address[1], questionBytes(data))
+        except ValueError:
+            return # No question that could match one.
+        future = self.pending.get(key)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        pass # ICMP errors (e.g. port unreachable) are treated like a timeout by the waiter.
+
+class UpstreamTransport:
+
+    def __init__(self, socketCount=UPSTREAM_SOCKETS, port=DNS_PORT, ednsPayload=EDNS_PAYLOAD, tcpPool=None):
+        self.socketCount = socketCount
+        self.port = port
+        self.protocols = []
+        # UDP payload size advertised to servers in an OPT record, 0 sends plain DNS queries.
+        self.ednsPayload = ednsPayload
+        # Servers that rejected a query with an OPT record, queried without one from then on
+        # (RFC 6891 Section 7).
+        self.noEdns = set()
+        # Persistent TCP connections, which transports may share. A shared pool is started
+        # and closed by its owner.
+        self.ownsPool = tcpPool is None
+        self.tcpPool = tcpPool if tcpPool is not None else ConnectionPool(port)
+        self.tcpQueries = 0
+        self.rotations = 0
+
+    async def open(self):
+        for count in range(0, self.socketCount):
+            self.protocols.append(await self.openSocket())
+        if self.ownsPool:
+            self.tcpPool.start()
+
+    async def openSocket(self):
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            UpstreamProtocol, family=socket.AF_INET, local_addr=('0.0.0.0', 0))
+        return protocol
+
+    async def rotate(self, protocol):
+        # Replaces protocol, a socket that has sent ROTATE_QUERIES queries, with one on a new
+        # ephemeral port. Returns the socket to send on.
+        protocol.retired = True
+        replacement = await self.openSocket()
+        if protocol not in self.protocols:
+            replacement.transport.close() # Closed meanwhile.
+            return protocol
+        self.protocols[self.protocols.index(protocol)] = replacement
+        if len(protocol.pending) == 0:
+            protocol.transport.close()
+        self.rotations += 1
+        return replacement
+
+    def close(self):
+        for protocol in self.protocols:
+            if protocol.transport is not None:
+                protocol.transport.close()
+        self.protocols = []
+        if self.ownsPool:
+            self.tcpPool.close()
+
+    def packet(self, queryId, query, server):
+        # The message sent upstream for query: its question alone, with RD cleared as the
+        # resolver does the recursion itself, and an OPT record unless server does not
+        # support EDNS0. Whatever the client put in its additional section is not forwarded.
+        flags = struct.unpack('!H', query[2:4])[0] & ~RD
+        sharedEncoder.begin(queryId, flags)
+        sharedEncoder.addRawQuestion(query[12:12 + len(questionBytes(query))])
+        if self.ednsPayload > 0 and server not in self.noEdns:
+            sharedEncoder.addOpt(self.ednsPayload)
+        return sharedEncoder.finish()
+
+    def rejectsEdns(self, response, server):
+        # Whether response is a server without EDNS0 support refusing the OPT record: an
+        # error without an OPT record of its own.
+        if self.ednsPayload == 0 or server in self.noEdns or response[3] & 0xF not in NO_EDNS_RCODES:
+            return False
+        try:
+            return parseMessage(response).opt is None
+        except ValueError:
+            return True
+
+    async def query(self, query, server, timeout):
+        # Sends query to server with a fresh transaction ID and waits for the matching reply.
+        # Returns the reply, or None if nothing matching arrives within timeout seconds.
+        response = await self.send(query, server, timeout)
+        if response is not None and self.rejectsEdns(response, server):
+            self.noEdns.add(server)
+            response = await self.send(query, server, timeout)
+        return response
+
+    async def send(self, query, server, timeout):
+        protocol = systemRandom.choice(self.protocols)
+        if protocol.sent >= ROTATE_QUERIES and not protocol.retired:
+            protocol = await self.rotate(protocol)
+        protocol.sent += 1
+        question = questionBytes(query)
+
+        while True:
+            queryId = randomId()
+            key = (queryId, server, self.port, question)
+            if key not in protocol.pending:
+                break
+        packet = self.packet(queryId, query, server)
+
+        future = asyncio.get_running_loop().create_future()
+        protocol.pending[key] = future
+        try:
+            protocol.transport.sendto(packet, (server, self.port))
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            protocol.pending.pop(key, None)
+            if protocol.retired and len(protocol.pending) == 0 and protocol not in self.protocols:
+                protocol.transport.close()
+
+    async def queryTcp(self, query, server, timeout):
+        # Sends query to server over TCP, for replies that were truncated over UDP (RFC 7766
+        # Section 5). Returns the reply, or None if the connection fails or no matching reply
+        # arrives within timeout seconds.
+        self.tcpQueries += 1
+        return await self.tcpPool.query(server, self.packet(0, query, server), timeout)